@@ -0,0 +1,14 @@
+"""gunicorn settings for the web process in the Procfile.
+
+Classroom chat long polls (projects.views.chat_updates) hold a request open
+for up to CHAT_POLL_TIMEOUT seconds, so the workers are gevent-based: a
+waiting poll is a paused greenlet rather than a busy worker process.
+"""
+worker_class = 'gevent'
+
+
+def post_fork(server, worker):
+    # psycopg2 talks to the database from C, outside the sockets gevent
+    # patches, so without this every query would block the whole worker
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
@@ -7,7 +7,11 @@ Copyright 2011, TokBox, Inc.
 
 
 import urllib
-import urllib2
+import urlparse
+import httplib
+import errno
+import socket
+import threading
 import datetime
 import calendar
 import time
@@ -15,9 +19,22 @@ import hmac
 import hashlib
 import base64
 import random
+from cStringIO import StringIO
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
 
 
+# The most time in seconds a request can take, retries included
 TIMEOUT = 10
+# Requests that couldn't be sent or got a server error are retried this
+# many times, waiting a random time of up to RETRY_BACKOFF * 2 ** attempt
+# seconds before each retry
+RETRIES = 2
+RETRY_BACKOFF = 0.1
+# Idle connections kept open for reuse
+POOL_SIZE = 4
 
 
 class OpenTokException(BaseException):
@@ -39,6 +56,16 @@ class AuthError(OpenTokException):
     pass
 
 
+class RequestNotSent(Exception):
+    """Raised by ConnectionPool when a request failed before it was sent, so
+    sending it again can't make the server act on it twice.
+    """
+
+    def __init__(self, error):
+        Exception.__init__(self, str(error))
+        self.error = error
+
+
 class SessionProperties(object):
     echoSuppression_enabled = None
     multiplexer_numOutputStreams = None
@@ -69,6 +96,125 @@ class OpenTokSession(object):
     def __init__(self, session_id):
         self.session_id = session_id
 
+
+def _quote_param(value):
+    """Quotes a value the way urllib.urlencode(params, True) does."""
+    if isinstance(value, unicode):
+        value = value.encode('ASCII', 'replace')
+    elif not isinstance(value, str):
+        value = str(value)
+    return urllib.quote_plus(value)
+
+
+def _is_closed_connection_error(error):
+    """Returns whether an error reading a response means the server had
+    already closed the connection, before the request reached it.
+
+    Timeouts never count: the server may be working on the request.
+    """
+    if isinstance(error, httplib.BadStatusLine):
+        return True
+    return (isinstance(error, socket.error) and
+            not isinstance(error, socket.timeout) and
+            error.errno in (errno.ECONNRESET, errno.EPIPE))
+
+
+def _find_element(xml, tags):
+    """Returns the first element in an XML document with one of tags.
+
+    The document is parsed incrementally, and only up to the end of that
+    element. Returns None if there isn't one.
+    """
+    for event, element in ElementTree.iterparse(StringIO(xml)):
+        if element.tag in tags:
+            return element
+    return None
+
+
+class ConnectionPool(object):
+    """Keeps HTTP connections to one server open for reuse.
+
+    Creating a connection for every request means a new TCP connection and
+    TLS handshake each time. Connections are instead returned to the pool
+    after their response is read, and the next request reuses the most
+    recently returned one. Safe to use from several threads.
+    """
+
+    def __init__(self, url, timeout=TIMEOUT, max_size=POOL_SIZE):
+        parts = urlparse.urlsplit(url)
+        if parts.scheme == 'https':
+            self.connection_class = httplib.HTTPSConnection
+        else:
+            self.connection_class = httplib.HTTPConnection
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.max_size = max_size
+        self.idle = []
+        self.lock = threading.Lock()
+        # Number of connections opened, for benchmarks and tests
+        self.connections_opened = 0
+
+    def _get_connection(self):
+        """Returns an idle connection (and True), or a new one (and False)."""
+        with self.lock:
+            if self.idle:
+                return self.idle.pop(), True
+            self.connections_opened += 1
+        return self.connection_class(self.host, self.port,
+                                     timeout=self.timeout), False
+
+    def _put_connection(self, connection):
+        with self.lock:
+            if len(self.idle) < self.max_size:
+                self.idle.append(connection)
+                return
+        connection.close()
+
+    def request(self, method, path, body=None, headers=None, timeout=None):
+        """Sends a request and returns its status and body.
+
+        timeout overrides the pool's timeout for this request. Raises
+        RequestNotSent if the request couldn't be sent. If a reused
+        connection turns out to have been closed by the server, the request
+        is sent again on a new connection.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        connection, reused = self._get_connection()
+        try:
+            if reused:
+                connection.sock.settimeout(timeout)
+            else:
+                connection.timeout = timeout
+                connection.connect()
+            connection.request(method, self.base_path + path, body,
+                               headers or {})
+        except (httplib.HTTPException, socket.error), e:
+            connection.close()
+            raise RequestNotSent(e)
+        try:
+            response = connection.getresponse()
+            data = response.read()
+        except (httplib.HTTPException, socket.error), e:
+            connection.close()
+            if reused and _is_closed_connection_error(e):
+                return self.request(method, path, body, headers, timeout)
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._put_connection(connection)
+        return response.status, data
+
+    def close(self):
+        """Closes all idle connections."""
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
 class OpenTokSDK(object):
     """Use this SDK to create tokens and interface with the server-side portion
     of the Opentok API.
@@ -76,9 +222,23 @@ class OpenTokSDK(object):
     TOKEN_SENTINEL = 'T1=='
     API_URL = 'https://api.opentok.com'
 
-    def __init__(self, api_key, api_secret):
+    def __init__(self, api_key, api_secret, api_url=None, timeout=TIMEOUT,
+                 retries=RETRIES, retry_backoff=RETRY_BACKOFF):
+        """api_url overrides API_URL, timeout is the most time in seconds a
+        request can take, retries included, and retries is how many times a
+        request that couldn't be sent or got a server error is tried again.
+        Requests that time out waiting for a response aren't retried.
+        """
         self.api_key = api_key
         self.api_secret = api_secret.strip()
+        # Copied for each signature, which saves setting up the key again
+        self._signer = hmac.new(self.api_secret, digestmod=hashlib.sha1)
+        if api_url is not None:
+            self.API_URL = api_url
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.connection_pool = ConnectionPool(self.API_URL, timeout)
 
     def generate_token(self, session_id=None, role=None, expire_time=None, connection_data=None, **kwargs):
         """
@@ -87,9 +247,13 @@ class OpenTokSDK(object):
         role: One of the constants defined in RoleConstants. Default is publisher, look in the documentation to learn more about roles.
         expire_time: Integer timestamp. You can override the default token expire time of 24h by choosing an explicit expire time. Can be up to 7d after create_time.
         """
-        create_time = datetime.datetime.utcnow()
-        if session_id is None:
-            session_id = ''
+        return self.generate_tokens([session_id], role, expire_time, connection_data)[0]
+
+    def generate_tokens(self, session_ids, role=None, expire_time=None, connection_data=None):
+        """
+        Generate a token for each of session_ids, in the same order. Takes the same arguments as generate_token, which apply to every token.
+        The arguments are only checked once, so this is faster than calling generate_token for each session.
+        """
         if not role:
             role = RoleConstants.PUBLISHER
 
@@ -98,37 +262,64 @@ class OpenTokSDK(object):
                 role != RoleConstants.MODERATOR:
             raise OpenTokException('%s is not a valid role' % role)
 
-        data_params = dict(
-            session_id=session_id,
-            create_time=calendar.timegm(create_time.timetuple()),
-            role=role,
-        )
+        now = time.time()
+        # Same as calendar.timegm(datetime.datetime.utcnow().timetuple())
+        create_time = int(now)
         if expire_time is not None:
             if isinstance(expire_time, datetime.datetime):
-                data_params['expire_time'] = calendar.timegm(expire_time.timetuple())
+                expire_time = calendar.timegm(expire_time.timetuple())
             else:
                 try:
-                    data_params['expire_time'] = int(expire_time)
+                    expire_time = int(expire_time)
                 except (ValueError, TypeError):
                     raise OpenTokException('Expire time must be a number')
 
-            if data_params['expire_time'] < time.time():
+            if expire_time < now:
                 raise OpenTokException('Expire time must be in the future')
 
-            if data_params['expire_time'] > time.time() + 2592000:
+            if expire_time > now + 2592000:
                 raise OpenTokException('Expire time must be in the next 30 days')
 
         if connection_data is not None:
             if len(connection_data) > 1000:
                 raise OpenTokException('Connection data must be less than 1000 characters')
-            data_params['connection_data'] = connection_data
-
-        data_params['nonce'] = random.randint(0,999999)
-        data_string = urllib.urlencode(data_params, True)
 
-        sig = self._sign_string(data_string, self.api_secret)
-        token_string = '%s%s' % (self.TOKEN_SENTINEL, base64.b64encode('partner_id=%s&sig=%s:%s' % (self.api_key, sig, data_string)))
-        return token_string
+        # Tokens have always urlencoded a dict of these parameters, so
+        # they're encoded in that dict's order. Only session_id and nonce
+        # change between tokens, so the rest is encoded once.
+        data_params = dict(
+            session_id='',
+            create_time=create_time,
+            role=role,
+        )
+        if expire_time is not None:
+            data_params['expire_time'] = expire_time
+        if connection_data is not None:
+            data_params['connection_data'] = connection_data
+        data_params['nonce'] = 0
+        template = []
+        for key, value in data_params.iteritems():
+            if key in ('session_id', 'nonce'):
+                template.append('%s=%%(%s)s' % (key, key))
+            else:
+                template.append(urllib.urlencode([(key, value)], True).replace('%', '%%'))
+        template = '&'.join(template)
+
+        token_prefix = 'partner_id=%s&sig=' % self.api_key
+        rand = random.random
+        tokens = []
+        for session_id in session_ids:
+            data_string = template % {
+                'session_id': _quote_param(session_id or ''),
+                # Same as random.randint(0, 999999), without its overhead
+                'nonce': int(rand() * 1000000),
+            }
+
+            signer = self._signer.copy()
+            signer.update(data_string.encode('utf-8'))
+            tokens.append(self.TOKEN_SENTINEL + base64.b64encode(
+                '%s%s:%s' % (token_prefix, signer.hexdigest(), data_string)))
+        return tokens
 
     def create_session(self, location='', properties={}, **kwargs):
         """Create a new session in the OpenTok API. Returns an OpenTokSession
@@ -145,22 +336,20 @@ class OpenTokSDK(object):
         params = dict(api_key=self.api_key)
         params['location'] = location
         params.update(properties)
-        dom = ''
+        response = ''
         try:
-            dom = self._do_request('/session/create', params)
+            response = self._do_request('/session/create', params)
         except RequestError:
             raise
         except Exception, e:
             raise RequestError('Failed to create session: %s' % str(e)  )
 
         try:
-            error = dom.getElementsByTagName('error')
-            if error:
-                error = error[0]
-                raise AuthError('Failed to create session (code=%s): %s' % (error.attributes['code'].value, error.firstChild.attributes['message'].value))
+            element = _find_element(response, ('error', 'session_id'))
+            if element.tag == 'error':
+                raise AuthError('Failed to create session (code=%s): %s' % (element.get('code'), element[0].get('message')))
 
-            session_id = dom.getElementsByTagName('session_id')[0].childNodes[0].nodeValue
-            return OpenTokSession(session_id)
+            return OpenTokSession(element.text)
         except Exception, e:
             raise OpenTokException('Failed to generate session: %s' % str(e))
 
@@ -169,8 +358,7 @@ class OpenTokSDK(object):
         return hmac.new(secret, string.encode('utf-8'), hashlib.sha1).hexdigest()
 
     def _do_request(self, url, params):
-        import xml.dom.minidom as xmldom
-
+        """Sends a request to the API and returns the body of its response."""
         if '_token' in params: #Do token auth if _token is present, partner auth normally
             auth_header = ('X-TB-TOKEN-AUTH', params['_token'])
             del params['_token']
@@ -180,29 +368,38 @@ class OpenTokSDK(object):
         method = 'POST' if params else 'GET'
         data_string = urllib.urlencode(params, True)
 
-        context_source = [
+        headers = dict([
             ('method', method),
             ('Content-Type', 'application/x-www-form-urlencoded'),
             ('Content-Length', len(data_string)),
             auth_header
-        ]
-
-        req_string = self.API_URL + url
-        try:
-            opener = urllib2.build_opener()
-            opener.addheaders = context_source
-            if data_string:
-                request = urllib2.Request(url=req_string, data=data_string)
-            else: #GET if no data_string
-                request = urllib2.Request(url=req_string)
+        ])
+
+        # Retries share the request's timeout rather than each getting
+        # their own
+        deadline = time.time() + self.timeout
+        attempt = 0
+        while True:
+            error = None
             try:
-                response = opener.open(request, timeout=TIMEOUT)
-            except TypeError: #Python2.6 added the timeout keyword, if it doesn't get accepted, try without it
-                response = opener.open(request)
-
-            dom = xmldom.parseString(response.read())
-            response.close()
-        except urllib2.HTTPError, e:
-            raise RequestError('Failed to send request: %s' % str(e))
-
-        return dom
+                status, body = self.connection_pool.request(
+                    method, url, data_string or None, headers,
+                    deadline - time.time())
+                if status < 500:
+                    break
+            except RequestNotSent, e:
+                error = e.error
+            # Randomized exponential backoff, so clients that failed
+            # together don't all retry together
+            backoff = random.uniform(0, self.retry_backoff * 2 ** attempt)
+            if attempt >= self.retries or time.time() + backoff >= deadline:
+                if error is not None:
+                    raise error
+                break
+            time.sleep(backoff)
+            attempt += 1
+
+        if status >= 400:
+            raise RequestError('Failed to send request: HTTP Error %s: %s'
+                               % (status, httplib.responses.get(status, '')))
+        return body
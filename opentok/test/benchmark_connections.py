@@ -0,0 +1,59 @@
+"""Compares creating sessions over new and reused connections.
+
+Run from the opentok directory:
+
+    PYTHONPATH=. python test/benchmark_connections.py
+"""
+import time
+import urllib
+import urllib2
+from optparse import OptionParser
+
+from OpenTokSDK import OpenTokSDK
+
+from fake_server import FakeOpenTokServer
+
+
+def create_sessions_without_pool(url, count):
+    """Creates sessions the way the SDK used to, opening a new connection
+    for every request.
+    """
+    data = urllib.urlencode({'api_key': 1, 'location': ''})
+    for i in range(count):
+        opener = urllib2.build_opener()
+        opener.addheaders = [('X-TB-PARTNER-AUTH', '1:secret')]
+        opener.open(url + '/session/create', data).read()
+
+
+def create_sessions_with_pool(url, count):
+    sdk = OpenTokSDK(1, 'secret', api_url=url)
+    for i in range(count):
+        sdk.create_session()
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--requests', type='int', default=500)
+    parser.add_option('--latency', type='float', default=0,
+                      help='Seconds the fake server waits before responding.')
+    options, args = parser.parse_args()
+
+    for name, create_sessions in (('New connection per request',
+                                   create_sessions_without_pool),
+                                  ('Pooled connections',
+                                   create_sessions_with_pool)):
+        server = FakeOpenTokServer(latency=options.latency)
+        server.start()
+        try:
+            start = time.time()
+            create_sessions(server.url, options.requests)
+            elapsed = time.time() - start
+        finally:
+            server.stop()
+        print '%s: %s sessions in %.3fs (%.2fms each), %s connections' % (
+            name, options.requests, elapsed,
+            elapsed * 1000 / options.requests, server.connections)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Compares reading API responses with minidom, as the SDK used to, and
+with the SDK's incremental parser.
+
+Run from the opentok directory:
+
+    PYTHONPATH=. python test/benchmark_responses.py
+"""
+import os
+import time
+import xml.dom.minidom as xmldom
+from optparse import OptionParser
+
+from OpenTokSDK import _find_element
+
+
+RESPONSES_DIR = os.path.join(os.path.dirname(__file__), 'responses')
+
+
+def read_with_minidom(xml):
+    """What create_session did with a response before."""
+    dom = xmldom.parseString(xml)
+    error = dom.getElementsByTagName('error')
+    if error:
+        error = error[0]
+        return (error.attributes['code'].value,
+                error.firstChild.attributes['message'].value)
+    return dom.getElementsByTagName('session_id')[0].childNodes[0].nodeValue
+
+
+def read_incrementally(xml):
+    element = _find_element(xml, ('error', 'session_id'))
+    if element.tag == 'error':
+        return element.get('code'), element[0].get('message')
+    return element.text
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--iterations', type='int', default=20000)
+    options, args = parser.parse_args()
+
+    for name in ('session_create.xml', 'error.xml'):
+        xml = open(os.path.join(RESPONSES_DIR, name)).read()
+        for reader in (read_with_minidom, read_incrementally):
+            start = time.time()
+            for i in range(options.iterations):
+                reader(xml)
+            elapsed = time.time() - start
+            print '%s, %s: %.1fus per response' % (
+                name, reader.__name__, elapsed * 1000000 / options.iterations)
+
+
+if __name__ == '__main__':
+    main()
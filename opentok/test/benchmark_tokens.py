@@ -0,0 +1,40 @@
+"""Reports how many tokens per second each way of generating them manages.
+
+Run from the opentok directory:
+
+    PYTHONPATH=. python test/benchmark_tokens.py
+"""
+import time
+from optparse import OptionParser
+
+from OpenTokSDK import OpenTokSDK
+
+import legacy_tokens
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--tokens', type='int', default=20000)
+    options, args = parser.parse_args()
+
+    sdk = OpenTokSDK(12345, 'not a real secret')
+    session_ids = ['1_session_%s' % i for i in range(options.tokens)]
+    benchmarks = (
+        ('0.91 generate_token',
+         lambda: [legacy_tokens.generate_token(sdk, session_id)
+                  for session_id in session_ids]),
+        ('generate_token',
+         lambda: [sdk.generate_token(session_id)
+                  for session_id in session_ids]),
+        ('generate_tokens',
+         lambda: sdk.generate_tokens(session_ids)),
+    )
+    for name, generate in benchmarks:
+        start = time.time()
+        generate()
+        elapsed = time.time() - start
+        print '%s: %.0f tokens/s' % (name, options.tokens / elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""A local stand-in for the OpenTok API, for tests and benchmarks.
+
+It answers /session/create with a new session id and keeps connections
+alive the way the real API does. It counts the connections it accepts and
+the requests it gets, so connection reuse and retries can be checked.
+
+    server = FakeOpenTokServer()
+    server.start()
+    sdk = OpenTokSDK(api_key, api_secret, api_url=server.url)
+    ...
+    server.stop()
+"""
+import BaseHTTPServer
+import SocketServer
+import itertools
+import os
+import threading
+import time
+
+
+SESSION_XML = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+               '<sessions><Session><session_id>%s</session_id>'
+               '<partner_id>%s</partner_id>'
+               '<create_dt>Mon Jan 07 12:00:00 PST 2013</create_dt>'
+               '</Session></sessions>')
+
+ERROR_XML = open(os.path.join(os.path.dirname(__file__), 'responses',
+                              'error.xml')).read()
+
+
+class FakeOpenTokHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open between requests
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one write, as a real server would. Unbuffered
+    # header writes get held back by Nagle's algorithm on reused
+    # connections.
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.count_connection()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.count_request()
+        if self.server.drop_connections:
+            # Close the connection after responding without saying so, as a
+            # server dropping an idle keep-alive connection would
+            self.close_connection = 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.path != '/session/create':
+            self.send_error(404)
+            return
+        if self.server.fail_next:
+            self.server.fail_next -= 1
+            self.send_error(503)
+            return
+        partner_id = self.headers.get('X-TB-PARTNER-AUTH', '').split(':')[0]
+        if self.server.auth_error:
+            body = ERROR_XML
+        else:
+            body = SESSION_XML % (self.server.new_session_id(), partner_id)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeOpenTokServer(SocketServer.ThreadingMixIn,
+                        BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0):
+        """latency is the number of seconds each response is delayed."""
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           FakeOpenTokHandler)
+        self.latency = latency
+        # The number of requests to fail with a 503 before succeeding
+        self.fail_next = 0
+        # Answer with an error document instead of a session
+        self.auth_error = False
+        # Close connections after each response without warning the client
+        self.drop_connections = False
+        self.connections = 0
+        self.requests = 0
+        self.session_ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://%s:%s' % self.server_address
+
+    def count_connection(self):
+        with self.lock:
+            self.connections += 1
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def new_session_id(self):
+        with self.lock:
+            return '1_fake_session_%s' % self.session_ids.next()
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
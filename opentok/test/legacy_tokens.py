@@ -0,0 +1,64 @@
+"""Token generation as it was in OpenTokSDK 0.91, for comparing against.
+
+generate_token here is the SDK's original method, unchanged apart from
+taking the SDK instance as an argument.
+"""
+import urllib
+import datetime
+import calendar
+import time
+import base64
+import random
+
+from OpenTokSDK import OpenTokException, RoleConstants
+
+
+def generate_token(self, session_id=None, role=None, expire_time=None, connection_data=None, **kwargs):
+    """
+    Generate a token which is passed to the JS API to enable widgets to connect to the Opentok api.
+    session_id: Specify a session_id to make this token only valid for that session_id.
+    role: One of the constants defined in RoleConstants. Default is publisher, look in the documentation to learn more about roles.
+    expire_time: Integer timestamp. You can override the default token expire time of 24h by choosing an explicit expire time. Can be up to 7d after create_time.
+    """
+    create_time = datetime.datetime.utcnow()
+    if session_id is None:
+        session_id = ''
+    if not role:
+        role = RoleConstants.PUBLISHER
+
+    if role != RoleConstants.SUBSCRIBER and \
+            role != RoleConstants.PUBLISHER and \
+            role != RoleConstants.MODERATOR:
+        raise OpenTokException('%s is not a valid role' % role)
+
+    data_params = dict(
+        session_id=session_id,
+        create_time=calendar.timegm(create_time.timetuple()),
+        role=role,
+    )
+    if expire_time is not None:
+        if isinstance(expire_time, datetime.datetime):
+            data_params['expire_time'] = calendar.timegm(expire_time.timetuple())
+        else:
+            try:
+                data_params['expire_time'] = int(expire_time)
+            except (ValueError, TypeError):
+                raise OpenTokException('Expire time must be a number')
+
+        if data_params['expire_time'] < time.time():
+            raise OpenTokException('Expire time must be in the future')
+
+        if data_params['expire_time'] > time.time() + 2592000:
+            raise OpenTokException('Expire time must be in the next 30 days')
+
+    if connection_data is not None:
+        if len(connection_data) > 1000:
+            raise OpenTokException('Connection data must be less than 1000 characters')
+        data_params['connection_data'] = connection_data
+
+    data_params['nonce'] = random.randint(0,999999)
+    data_string = urllib.urlencode(data_params, True)
+
+    sig = self._sign_string(data_string, self.api_secret)
+    token_string = '%s%s' % (self.TOKEN_SENTINEL, base64.b64encode('partner_id=%s&sig=%s:%s' % (self.api_key, sig, data_string)))
+    return token_string
@@ -0,0 +1,92 @@
+"""Tests for the SDK's HTTP transport, run against a local fake server.
+
+Run from the opentok directory:
+
+    PYTHONPATH=. python test/test_connection_pool.py
+"""
+import socket
+import time
+import unittest
+
+from OpenTokSDK import OpenTokSDK, RequestError, RETRIES
+
+from fake_server import FakeOpenTokServer
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeOpenTokServer()
+        self.server.start()
+        self.sdk = OpenTokSDK(1, 'secret', api_url=self.server.url,
+                              retry_backoff=0)
+
+    def tearDown(self):
+        self.sdk.connection_pool.close()
+        self.server.stop()
+
+    def test_connection_reuse(self):
+        session_ids = set(self.sdk.create_session().session_id
+                          for i in range(5))
+        self.assertEqual(len(session_ids), 5)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_closed_connection(self):
+        self.sdk.create_session()
+        # Simulate the server dropping an idle keep-alive connection
+        for connection in self.sdk.connection_pool.idle:
+            connection.sock.close()
+        self.assertTrue(self.sdk.create_session().session_id)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_connection_closed_by_server(self):
+        self.server.drop_connections = True
+        self.sdk.create_session()
+        # Let the server close its end
+        time.sleep(0.1)
+        self.assertTrue(self.sdk.create_session().session_id)
+        self.assertEqual(self.server.requests, 2)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_retry_connect_errors(self):
+        # Nothing listens on a port freed straight after binding it
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        url = 'http://%s:%s' % listener.getsockname()
+        listener.close()
+        sdk = OpenTokSDK(1, 'secret', api_url=url, retry_backoff=0)
+        self.assertRaises(RequestError, sdk.create_session)
+        self.assertEqual(sdk.connection_pool.connections_opened, RETRIES + 1)
+
+    def test_timeout_not_retried(self):
+        self.server.latency = 0.5
+        sdk = OpenTokSDK(1, 'secret', api_url=self.server.url, timeout=0.2,
+                         retry_backoff=0)
+        started = time.time()
+        self.assertRaises(RequestError, sdk.create_session)
+        self.assertTrue(time.time() - started < 0.4)
+        # Wait for the server to have read the request
+        time.sleep(0.1)
+        self.assertEqual(self.server.requests, 1)
+
+    def test_retries_limited_by_timeout(self):
+        self.server.latency = 0.1
+        self.server.fail_next = 100
+        sdk = OpenTokSDK(1, 'secret', api_url=self.server.url, timeout=0.35,
+                         retries=100, retry_backoff=0)
+        started = time.time()
+        self.assertRaises(RequestError, sdk.create_session)
+        self.assertTrue(time.time() - started < 0.5)
+        self.assertTrue(self.server.requests <= 4)
+
+    def test_retry_server_errors(self):
+        self.server.fail_next = 2
+        self.assertTrue(self.sdk.create_session().session_id)
+
+    def test_too_many_server_errors(self):
+        self.server.fail_next = 3
+        self.assertRaises(RequestError, self.sdk.create_session)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""Tests for reading API responses.
+
+Run from the opentok directory:
+
+    PYTHONPATH=. python test/test_responses.py
+"""
+import os
+import unittest
+
+from OpenTokSDK import OpenTokSDK, AuthError, OpenTokException, _find_element
+
+from fake_server import FakeOpenTokServer
+
+
+RESPONSES_DIR = os.path.join(os.path.dirname(__file__), 'responses')
+
+
+def read_response(name):
+    return open(os.path.join(RESPONSES_DIR, name)).read()
+
+
+class TestFindElement(unittest.TestCase):
+
+    def test_session(self):
+        element = _find_element(read_response('session_create.xml'),
+                                ('error', 'session_id'))
+        self.assertEqual(element.tag, 'session_id')
+        self.assertTrue(element.text.startswith('1_MX4xMjM0NX4'))
+
+    def test_error(self):
+        element = _find_element(read_response('error.xml'),
+                                ('error', 'session_id'))
+        self.assertEqual(element.tag, 'error')
+        self.assertEqual(element.get('code'), '-1')
+        self.assertEqual(element[0].get('message'),
+                         'Invalid partner credentials')
+
+    def test_missing(self):
+        self.assertEqual(_find_element('<sessions/>', ('session_id',)), None)
+
+
+class TestCreateSession(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeOpenTokServer()
+        self.server.start()
+        self.sdk = OpenTokSDK(1, 'secret', api_url=self.server.url)
+
+    def tearDown(self):
+        self.sdk.connection_pool.close()
+        self.server.stop()
+
+    def test_session(self):
+        self.assertEqual(self.sdk.create_session().session_id,
+                         '1_fake_session_1')
+
+    def test_error(self):
+        self.server.auth_error = True
+        try:
+            self.sdk.create_session()
+        except AuthError, e:
+            self.assertEqual(str(e), 'Failed to create session (code=-1): '
+                                     'Invalid partner credentials')
+        else:
+            self.fail('AuthError not raised')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+"""Checks that tokens are generated exactly as OpenTokSDK 0.91 did.
+
+Run from the opentok directory:
+
+    PYTHONPATH=. python test/test_tokens.py
+"""
+import datetime
+import random
+import time
+import unittest
+
+from OpenTokSDK import OpenTokSDK, OpenTokException
+
+import legacy_tokens
+
+
+class TestTokens(unittest.TestCase):
+
+    def setUp(self):
+        self.sdk = OpenTokSDK(12345, 'not a real secret')
+
+    def assertSameTokens(self, session_ids, **kwargs):
+        """Generates tokens both ways from the same random state, retrying
+        if the clock ticks over to a new second in between.
+        """
+        while True:
+            second = int(time.time())
+            random.seed(42)
+            expected = [legacy_tokens.generate_token(self.sdk, session_id,
+                                                     **kwargs)
+                        for session_id in session_ids]
+            random.seed(42)
+            batch = self.sdk.generate_tokens(session_ids, **kwargs)
+            random.seed(42)
+            single = [self.sdk.generate_token(session_id, **kwargs)
+                      for session_id in session_ids]
+            if int(time.time()) == second:
+                break
+        self.assertEqual(batch, expected)
+        self.assertEqual(single, expected)
+
+    def test_default_token(self):
+        self.assertSameTokens(['1_session'])
+
+    def test_no_session(self):
+        self.assertSameTokens([None])
+
+    def test_quoting(self):
+        self.assertSameTokens([u'1_session/+=&%\xe9', 42],
+                              connection_data=u'name=Zo\xeb & co')
+
+    def test_batch(self):
+        self.assertSameTokens(['1_session_%s' % i for i in range(20)])
+
+    def test_options(self):
+        expire_time = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+        self.assertSameTokens(['1_session'], role='moderator',
+                              expire_time=expire_time,
+                              connection_data='userId=42')
+        self.assertSameTokens(['1_session'], role='subscriber',
+                              expire_time=int(time.time()) + 3600)
+
+    def test_invalid_arguments(self):
+        self.assertRaises(OpenTokException, self.sdk.generate_tokens,
+                          ['1_session'], role='owner')
+        self.assertRaises(OpenTokException, self.sdk.generate_tokens,
+                          ['1_session'], expire_time=time.time() - 60)
+        self.assertRaises(OpenTokException, self.sdk.generate_tokens,
+                          ['1_session'], connection_data='x' * 1001)
+
+
+if __name__ == '__main__':
+    unittest.main()
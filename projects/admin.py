@@ -20,11 +20,16 @@ class RequiredSkillInline(admin.StackedInline):
 
 class ProjectAdmin(admin.ModelAdmin):
     inlines = (RequiredSkillInline, ProjectFileInline)
-    list_display = ('title', 'student', 'published', 'completed', 'created', 'modified')
+    list_display = ('title', 'student', 'published', 'completed', 'bid_count',
+                    'last_bid_at', 'created', 'modified')
     list_filter = ('published', 'completed', 'project_type', 'budget_type')
     search_fields = ('title', 'description', 'category__title')
     date_hierarchy = 'created'
 
+    def save_related(self, request, form, formsets, change):
+        super(ProjectAdmin, self).save_related(request, form, formsets, change)
+        form.instance.update_search_index()
+
 
 class BidFileInline(admin.TabularInline):
     model = BidFile
@@ -1,18 +1,23 @@
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
+from django.http import Http404
 from django.shortcuts import render_to_response
 from django.shortcuts import get_object_or_404
 from django.template import RequestContext
+from django.template.loader import render_to_string
 from django.utils import simplejson
 from django.utils.html import escape
 
 from dajaxice.decorators import dajaxice_register
 
+from .chat_buffer import buffer as chat_buffer
 from .forms import BidForm
 from .forms import BidFileFormSet
+from .models import AwardError
 from .models import Bid
 from .models import Classroom
 from .models import Project
+from .pagination import InvalidCursor
 
 
 @login_required
@@ -48,43 +53,86 @@ def decline_bid(request, project_id, bid_id):
 
 @dajaxice_register
 @login_required
-def award_project(request, project_id, bid_id):
-    """Awards the project to the selected bid."""
-    project = get_object_or_404(Project, pk=project_id)
-    bid = get_object_or_404(Bid, pk=bid_id)
-    if bid.project != project:
-        raise PermissionDenied("Bid is not associated with project.")
-    if bid.project.student != project.student:
-        raise PermissionDenied("You do not have permission to alter bids on this project.")
-    if bid.project.get_status() != "Open":
-        raise PermissionDenied("Only open projects can be awarded.")
-    bid.declined = False
-    bid.awarded = True
-    bid.save()
-    return simplejson.dumps({'message': 'Bid awarded',
-                             'bid_id': bid.id})
+def decline_bids(request, project_id, bid_ids=None):
+    """Declines the selected bids, or all bids except the awarded one if no
+    bids are selected.
+    """
+    try:
+        declined_bid_ids = Project.decline_bids(project_id, request.user,
+                                                bid_ids)
+    except (ValueError, TypeError, Project.DoesNotExist):
+        raise Http404
+    except AwardError, e:
+        raise PermissionDenied(str(e))
+    return simplejson.dumps({'message': 'Bids declined',
+                             'bid_ids': declined_bid_ids})
 
 @dajaxice_register
 @login_required
-def chat_message(request, classroom_id, message):
+def award_project(request, project_id, bid_id):
+    """Awards the project to the selected bid and declines the others.
+
+    The response includes the declined bids and the project's new status so
+    the page can be updated without reloading it.
     """
-    Saves classroom chat messages to the DB and returns them in TokBox-ready format.
+    try:
+        state = Project.award(project_id, bid_id, request.user)
+    except (ValueError, Project.DoesNotExist, Bid.DoesNotExist):
+        raise Http404
+    except AwardError, e:
+        raise PermissionDenied(str(e))
+    state['message'] = 'Bid awarded'
+    return simplejson.dumps(state)
+
+@dajaxice_register(method='POST')
+@login_required
+def chat_message(request, classroom_id, message):
+    """Queues a classroom chat message to be saved to the DB.
+
+    Everyone in the classroom, including the sender, gets the message from
+    the chat_updates long poll once it's saved. The message_html returned
+    here is only an acknowledgement, which the classroom page ignores.
     """
     user = request.user
-    classroom = get_object_or_404(Classroom, pk=classroom_id)
-    project = classroom.project
-    project_student = project.student
-    project_tutor = project.get_tutor()
-    if project_student.user != user and project_tutor.user != user:
+    try:
+        classroom_id = int(classroom_id)
+    except ValueError:
+        raise Http404
+    if not Classroom.is_member(classroom_id, user):
         raise PermissionDenied("Only the project's student or tutor can add"
                                " messages to this room.")
-    message = classroom.chat_entries.create(user=user, message=message)
+    chat_buffer.append(classroom_id, user.pk, message)
     # TokBox's StateManager eats single backslashes.
-    safe_message = escape(message.message).replace('\\', '\\\\')
-    safe_username = escape(message.user.get_full_name()).replace('\\', '\\\\')
+    safe_message = escape(message).replace('\\', '\\\\')
+    safe_username = escape(user.get_full_name()).replace('\\', '\\\\')
     if safe_username == '':
-        safe_username = message.user.username
+        safe_username = user.username
     # Generating HTML here rather than in the template because TokBox's
-    # StateManager can only set a single string at a time.
-    message_html = '<div class="chat-message" data-message_id="%s"><p>%s: %s</p></div>' % (message.id, safe_username, safe_message)
+    # StateManager can only set a single string at a time. The message has
+    # no id until it's saved.
+    message_html = '<div class="chat-message"><p>%s: %s</p></div>' % (safe_username, safe_message)
     return simplejson.dumps({'message_html': message_html})
+
+@dajaxice_register(method='GET')
+@login_required
+def chat_history(request, classroom_id, cursor):
+    """Returns the chat messages sent before cursor, oldest first, and the
+    cursor for the messages before those.
+    """
+    try:
+        classroom_id = int(classroom_id)
+    except ValueError:
+        raise Http404
+    if not Classroom.is_member(classroom_id, request.user):
+        raise PermissionDenied("Only the project's student or tutor can read"
+                               " this room's messages.")
+    # Reading the messages only needs the classroom's id
+    classroom = Classroom(pk=classroom_id)
+    try:
+        page = classroom.chat_history(cursor)
+    except InvalidCursor:
+        raise Http404
+    messages_html = render_to_string('projects/chat_messages.html',
+                                     {'chatlog': page.object_list[::-1]})
+    return simplejson.dumps({'messages_html': messages_html,
+                             'earlier_cursor': page.next_cursor()})
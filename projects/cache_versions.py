@@ -0,0 +1,68 @@
+"""Version stamps for cached project cards.
+
+A project card is cached under the versions of everything it shows: the
+project itself (including its bid count and status), its category and the
+student who posted it. Changing any of them gives it a new version, so the
+next render misses the cache and stale cards are never served. Nothing has
+to be deleted from the cache; old cards just expire.
+
+Versions are microsecond timestamps rather than incremented counters, so a
+version that's been evicted from the cache is replaced by a newer one
+instead of starting again from a number an old card was cached under.
+"""
+import time
+
+from django.core.cache import cache
+
+
+# How long rendered cards and their versions are kept
+CARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+VERSION_KEY = 'projects:version:%s:%s'
+
+
+def new_version():
+    return int(time.time() * 1000000)
+
+
+def get_versions(kind, pks):
+    """Returns a dict of the current version for each pk.
+
+    Objects without a version in the cache are given one.
+    """
+    keys = dict((VERSION_KEY % (kind, pk), pk) for pk in pks)
+    versions = cache.get_many(keys.keys())
+    missing = dict((key, new_version()) for key in keys
+                   if key not in versions)
+    if missing:
+        cache.set_many(missing, CARD_CACHE_TIMEOUT)
+        versions.update(missing)
+    return dict((keys[key], version) for key, version in versions.iteritems())
+
+
+def bump_versions(kind, pks):
+    """Gives each object a new version, invalidating cached cards."""
+    version = new_version()
+    cache.set_many(dict((VERSION_KEY % (kind, pk), version) for pk in pks),
+                   CARD_CACHE_TIMEOUT)
+
+
+def bump_version(kind, pk):
+    bump_versions(kind, [pk])
+
+
+def set_card_versions(projects):
+    """Sets card_version on each project to a key for its cached card.
+
+    Projects should have been fetched with their student and category.
+    """
+    project_versions = get_versions('project', [p.pk for p in projects])
+    category_versions = get_versions('category',
+                                     set(p.category_id for p in projects))
+    user_versions = get_versions('user',
+                                 set(p.student.user_id for p in projects))
+    for project in projects:
+        project.card_version = '%s.%s.%s' % (
+            project_versions[project.pk],
+            category_versions[project.category_id],
+            user_versions[project.student.user_id])
@@ -0,0 +1,130 @@
+"""Long-polling delivery of classroom chat messages.
+
+A client asks for the messages newer than a settled message id that it
+hasn't seen yet. If there aren't any the request waits on an in-process
+channel, which is notified whenever a Chatlog row is saved, instead of the
+client having to poll again.
+
+Ids are assigned when rows are inserted, not when they're committed, so a
+message can become visible after one with a higher id has already been
+delivered. Clients therefore keep re-reading messages until they're
+SETTLE_TIME seconds old, sending the ids they've already got above the
+settled id so those aren't returned again.
+
+The channel only hears about messages saved by the same process, so a
+waiting request also checks the database every POLL_INTERVAL seconds to
+pick up messages saved by other processes.
+
+Waiting requests need workers that can hold them cheaply; the Procfile runs
+gunicorn with gevent workers (see gunicorn.conf.py) for this.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+
+# How long a request waits for new messages before returning empty-handed,
+# unless CHAT_POLL_TIMEOUT is set
+POLL_TIMEOUT = 25
+
+# How often a waiting request checks the database for messages the channel
+# didn't hear about
+POLL_INTERVAL = 5
+
+# Most messages returned at once
+MAX_MESSAGES = 50
+
+# Seconds within which a saved message's transaction is assumed to commit
+SETTLE_TIME = 10
+
+# Most already seen ids a client can send
+MAX_SEEN_IDS = 200
+
+
+class ChatChannel(object):
+    """Lets requests wait for new messages in a classroom.
+
+    Only the newest message id for each classroom is kept; the messages
+    themselves are read from the database.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.latest_ids = {}
+
+    def publish(self, classroom_id, message_id):
+        """Wakes the requests waiting on a classroom."""
+        with self.condition:
+            if message_id > self.latest_ids.get(classroom_id, 0):
+                self.latest_ids[classroom_id] = message_id
+            self.condition.notify_all()
+
+    def wait(self, classroom_id, after_id, timeout):
+        """Waits for a message newer than after_id to be published.
+
+        Returns True if one was, or False if timeout seconds passed first.
+        """
+        deadline = time.time() + timeout
+        with self.condition:
+            while self.latest_ids.get(classroom_id, 0) <= after_id:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+            return True
+
+
+channel = ChatChannel()
+
+
+def get_new_messages(classroom, after_id, seen_ids=(), timeout=None):
+    """Returns a classroom's messages newer than after_id, oldest first,
+    leaving out the ones in seen_ids.
+
+    Waits up to timeout seconds for a message if there aren't any yet, and
+    returns an empty list if none arrives.
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'CHAT_POLL_TIMEOUT', POLL_TIMEOUT)
+    deadline = time.time() + timeout
+    messages = classroom.chat_entries.select_related('user').order_by('pk')
+    messages = messages.filter(pk__gt=after_id)
+    if seen_ids:
+        messages = messages.exclude(pk__in=seen_ids)
+    # Wait for messages past the ones already seen; ones that commit out of
+    # order are picked up by the periodic database check
+    latest_seen_id = max([after_id] + list(seen_ids))
+    while True:
+        new_messages = list(messages[:MAX_MESSAGES])
+        remaining = deadline - time.time()
+        if new_messages or remaining <= 0:
+            return new_messages
+        # Don't hold on to a database connection, or to a transaction that
+        # can't see newer rows, while waiting
+        if not transaction.is_managed():
+            connection.close()
+        channel.wait(classroom.pk, latest_seen_id,
+                     min(remaining, POLL_INTERVAL))
+
+
+def get_settled_id(classroom, after_id, up_to_id=None):
+    """Returns the id a client can read from next time instead of after_id.
+
+    That's the newest message at least SETTLE_TIME seconds old, no newer
+    than up_to_id, since any message with a lower id should have been
+    committed by then. The client must already have every message between
+    after_id and up_to_id.
+    """
+    cutoff = timezone.now() - timedelta(seconds=SETTLE_TIME)
+    settled = classroom.chat_entries.filter(pk__gt=after_id,
+                                            created__lte=cutoff)
+    if up_to_id is not None:
+        settled = settled.filter(pk__lte=up_to_id)
+    settled_id = settled.aggregate(settled_id=Max('pk'))['settled_id']
+    return settled_id or after_id
@@ -0,0 +1,150 @@
+"""Write-behind saving of classroom chat messages.
+
+Sending a message only appends it to an in-memory buffer, so chat doesn't
+wait on the database. A background thread saves the buffered messages with
+bulk_create at least every CHAT_FLUSH_INTERVAL seconds, or sooner once
+FLUSH_SIZE messages are waiting, and whatever is left is saved when the
+process exits cleanly. A process that's killed outright, like a gunicorn
+worker killed for timing out, loses the messages sent since the last flush.
+
+A message's created time is set when it's saved rather than when it was
+sent, at most one flush interval later.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db import connection
+from django.db import transaction
+from django.db.models import Max
+
+from .chat import channel
+from .models import Chatlog
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds between flushes, unless CHAT_FLUSH_INTERVAL is set
+FLUSH_INTERVAL = 1
+
+# Number of waiting messages that triggers a flush before the interval is up
+FLUSH_SIZE = 100
+
+# Small enough for SQLite's limit on query parameters
+BATCH_SIZE = 100
+
+
+class ChatBuffer(object):
+    """Collects chat messages and saves them in batches."""
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.messages = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        # Every message saved from now on has a higher id than this
+        self.saved_id = None
+
+    def append(self, classroom_id, user_id, message):
+        """Adds a message to be saved with the next flush."""
+        with self.lock:
+            self.messages.append(Chatlog(classroom_id=classroom_id,
+                                         user_id=user_id,
+                                         message=message))
+            full = len(self.messages) >= FLUSH_SIZE
+            # The thread is started on first use so that processes forked
+            # after this module is imported each get their own
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+        if full:
+            self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            if self.stopped.is_set():
+                return
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Couldn't save chat messages")
+                # Reconnect for the next attempt
+                connection.close()
+
+    def stop(self):
+        """Stops the flush thread and saves the messages left.
+
+        The buffer doesn't flush on its own after this.
+        """
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join()
+        self.flush()
+
+    def flush(self):
+        """Saves the buffered messages.
+
+        Messages that couldn't be saved because of a database error are kept
+        for the next flush. Ones that break a constraint are dropped.
+        """
+        with self.flush_lock:
+            with self.lock:
+                messages, self.messages = self.messages, []
+            if not messages:
+                return
+            if self.saved_id is None:
+                self.saved_id = Chatlog.objects.aggregate(
+                    saved_id=Max('id'))['saved_id'] or 0
+            for start in range(0, len(messages), BATCH_SIZE):
+                batch = messages[start:start + BATCH_SIZE]
+                try:
+                    self.save(batch)
+                except IntegrityError:
+                    # One bad message fails its whole batch, so find it by
+                    # saving the batch's messages one at a time
+                    for i, message in enumerate(batch):
+                        try:
+                            self.save([message])
+                        except IntegrityError:
+                            logger.exception(
+                                "Dropped a chat message from user %s in "
+                                "classroom %s", message.user_id,
+                                message.classroom_id)
+                        except Exception:
+                            self.keep(messages[start + i:])
+                            raise
+                except Exception:
+                    self.keep(messages[start:])
+                    raise
+            # bulk_create doesn't send post_save or set ids, so wake the long
+            # polls for each classroom here, only looking at the messages
+            # saved since the last flush rather than each classroom's history
+            classroom_ids = set(m.classroom_id for m in messages)
+            latest_ids = Chatlog.objects.filter(
+                pk__gt=self.saved_id, classroom__in=classroom_ids).values(
+                'classroom').annotate(latest_id=Max('id'))
+            for row in latest_ids:
+                channel.publish(row['classroom'], row['latest_id'])
+                self.saved_id = max(self.saved_id, row['latest_id'])
+
+    def save(self, messages):
+        with transaction.commit_on_success():
+            Chatlog.objects.bulk_create(messages)
+
+    def keep(self, messages):
+        """Puts unsaved messages back at the front of the buffer."""
+        with self.lock:
+            self.messages[:0] = messages
+
+
+buffer = ChatBuffer(getattr(settings, 'CHAT_FLUSH_INTERVAL', FLUSH_INTERVAL))
+atexit.register(buffer.stop)
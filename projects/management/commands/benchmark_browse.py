@@ -0,0 +1,145 @@
+import random
+from datetime import timedelta
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db import transaction
+from django.test.client import RequestFactory
+from django.utils import timezone
+
+from projects.models import Bid
+from projects.models import Category
+from projects.models import Project
+from projects.views import ProjectListView
+from users.models import Student
+from users.models import Tutor
+
+
+class Command(BaseCommand):
+    help = ("Seeds a synthetic set of projects and bids, prints the query "
+            "plans used by the browse page and bid lookups, then rolls "
+            "everything back. Run it before and after migrating to compare "
+            "the plans.")
+    option_list = BaseCommand.option_list + (
+        make_option('--projects', type='int', dest='projects', default=100000,
+                    help='Number of projects to seed.'),
+        make_option('--bids', type='int', dest='bids', default=3,
+                    help='Number of bids to seed per project.'),
+    )
+    # Small enough for SQLite's limit on query parameters
+    batch_size = 50
+
+    @transaction.commit_manually
+    def handle(self, *args, **options):
+        cursor = connection.cursor()
+        if connection.vendor == 'sqlite':
+            # Python's sqlite3 module commits before statements like EXPLAIN
+            # and ANALYZE unless it's left to us to begin the transaction
+            connection.connection.isolation_level = None
+            cursor.execute('BEGIN')
+        try:
+            self.seed(options['projects'], options['bids'])
+            cursor.execute('ANALYZE')
+            self.explain_browse()
+            self.explain_bids()
+        finally:
+            transaction.rollback()
+
+    def seed(self, project_count, bids_per_project):
+        self.stdout.write('Seeding %s projects with %s bids each...\n'
+                          % (project_count, bids_per_project))
+        student = Student.objects.create(
+            user=User.objects.create(username='benchmark_student'))
+        self.tutors = [Tutor.objects.create(
+            user=User.objects.create(username='benchmark_tutor_%s' % i))
+            for i in range(20)]
+        self.categories = [Category.objects.create(title='Benchmark %s' % i)
+                           for i in range(10)]
+        now = timezone.now()
+
+        # Spread the created times out instead of letting auto_now_add
+        # stamp every row with the same time
+        created_fields = [Project._meta.get_field('created'),
+                          Bid._meta.get_field('created')]
+        for field in created_fields:
+            field.auto_now_add = False
+        try:
+            projects = []
+            for i in range(project_count):
+                created = now - timedelta(minutes=random.randint(0, 525600))
+                completed = random.random() < 0.2
+                projects.append(Project(student=student,
+                                        title='Benchmark project %s' % i,
+                                        category=random.choice(self.categories),
+                                        description='Synthetic project.',
+                                        published=random.random() < 0.9,
+                                        completed=completed,
+                                        is_awarded=completed or random.random() < 0.3,
+                                        bid_count=bids_per_project,
+                                        created=created,
+                                        modified=created))
+            self.bulk_create(Project, projects)
+
+            bids = []
+            for project_id, created in Project.objects.filter(
+                    student=student).values_list('pk', 'created').iterator():
+                for i in range(bids_per_project):
+                    bids.append(Bid(project_id=project_id,
+                                    tutor=random.choice(self.tutors),
+                                    description='Synthetic bid.',
+                                    budget_type='fixed',
+                                    budget='10.00',
+                                    created=created,
+                                    modified=created))
+                if len(bids) >= self.batch_size:
+                    self.bulk_create(Bid, bids)
+                    bids = []
+            self.bulk_create(Bid, bids)
+        finally:
+            for field in created_fields:
+                field.auto_now_add = True
+
+    def bulk_create(self, model, objs):
+        for start in range(0, len(objs), self.batch_size):
+            model.objects.bulk_create(objs[start:start + self.batch_size])
+
+    def explain(self, title, queryset):
+        """Prints the database's plan for a queryset."""
+        if connection.vendor == 'sqlite':
+            explain = 'EXPLAIN QUERY PLAN '
+        else:
+            explain = 'EXPLAIN '
+        sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+        cursor = connection.cursor()
+        cursor.execute(explain + sql, params)
+        self.stdout.write('\n%s\n' % title)
+        for row in cursor.fetchall():
+            self.stdout.write('    %s\n' % ' '.join(unicode(i) for i in row))
+
+    def explain_browse(self):
+        """Explains the browse page's query for each filter."""
+        request_factory = RequestFactory()
+        filters = (('All', {}),
+                   ('Open', {'s': 'open'}),
+                   ('Awarded', {'s': 'awarded'}),
+                   ('Closed', {'s': 'closed'}),
+                   ('Category', {'c': self.categories[0].pk}),
+                   ('Open in category', {'c': self.categories[0].pk,
+                                         's': 'open'}))
+        for title, params in filters:
+            view = ProjectListView()
+            view.request = request_factory.get('/', params)
+            view.args = ()
+            view.kwargs = {}
+            queryset = view.get_queryset()[:view.paginate_by]
+            self.explain('Browse: %s' % title, queryset)
+
+    def explain_bids(self):
+        """Explains the bid lookups used by awards and tutor dashboards."""
+        project = Project.objects.filter(bid_count__gt=0)[0]
+        self.explain('Awarded bid for a project',
+                     Bid.objects.filter(project=project, awarded=True))
+        self.explain("A tutor's newest bids",
+                     Bid.objects.filter(tutor=self.tutors[0]).order_by('-created')[:10])
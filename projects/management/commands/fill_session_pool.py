@@ -0,0 +1,57 @@
+import time
+from datetime import timedelta
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand
+from django.utils import timezone
+
+from opentok.OpenTokSDK import OpenTokException
+
+from projects.models import TokboxSession
+from projects.tokbox import create_session_id
+from projects.tokbox import record_metric
+
+
+class Command(NoArgsCommand):
+    help = ("Creates TokBox sessions until the pool of unclaimed sessions "
+            "for new classrooms is full. With --interval it keeps topping "
+            "the pool up, for running as a worker.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--size', type='int', dest='size',
+                    default=getattr(settings, 'TOKBOX_SESSION_POOL_SIZE', 20),
+                    help='Number of unclaimed sessions to keep.'),
+        make_option('--interval', type='float', dest='interval', default=None,
+                    help='Seconds to wait between top ups. Runs once if '
+                         'not given.'),
+    )
+    # Claimed sessions are deleted once they're this old
+    keep_claimed = timedelta(days=1)
+
+    def handle_noargs(self, **options):
+        while True:
+            self.fill(options['size'])
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
+
+    def fill(self, size):
+        TokboxSession.objects.filter(
+            claimed_at__lt=timezone.now() - self.keep_claimed).delete()
+        pool_size = TokboxSession.objects.filter(claimed_at=None).count()
+        created = 0
+        start = time.time()
+        try:
+            for i in range(size - pool_size):
+                TokboxSession.objects.create(session_id=create_session_id())
+                created += 1
+        except OpenTokException, e:
+            self.stderr.write('Failed to create a session: %s\n' % e)
+        elapsed = time.time() - start
+        pool_size += created
+        record_metric('SessionPool/Size', pool_size)
+        record_metric('SessionPool/Refills', created)
+        if created:
+            record_metric('SessionPool/RefillRate', created / elapsed)
+        self.stdout.write('Created %s sessions in %.2fs, %s in the pool.\n'
+                          % (created, elapsed, pool_size))
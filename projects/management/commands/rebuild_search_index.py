@@ -0,0 +1,16 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from projects.models import Project
+
+
+class Command(NoArgsCommand):
+    help = "Rebuilds the search terms for every project."
+
+    def handle_noargs(self, **options):
+        count = 0
+        with transaction.commit_on_success():
+            for project in Project.objects.all().iterator():
+                project.update_search_index()
+                count += 1
+        self.stdout.write('Indexed %s projects.\n' % count)
@@ -0,0 +1,33 @@
+from django.core.management.base import NoArgsCommand
+from django.db import connection
+from django.db import transaction
+
+from projects.cache_versions import bump_versions
+from projects.models import Bid
+from projects.models import Project
+
+
+class Command(NoArgsCommand):
+    help = ("Recalculates every project's bid count and last bid time from "
+            "its bids.")
+
+    def handle_noargs(self, **options):
+        qn = connection.ops.quote_name
+        project_table = qn(Project._meta.db_table)
+        bid_table = qn(Bid._meta.db_table)
+        bids_for_project = ('FROM %s WHERE %s.%s = %s.%s'
+                            % (bid_table, bid_table,
+                               qn(Bid._meta.get_field('project').column),
+                               project_table, qn(Project._meta.pk.column)))
+        sql = ('UPDATE %s SET %s = (SELECT COUNT(*) %s), %s = (SELECT MAX(%s) %s)'
+               % (project_table,
+                  qn(Project._meta.get_field('bid_count').column),
+                  bids_for_project,
+                  qn(Project._meta.get_field('last_bid_at').column),
+                  qn(Bid._meta.get_field('created').column),
+                  bids_for_project))
+        cursor = connection.cursor()
+        cursor.execute(sql)
+        transaction.commit_unless_managed()
+        bump_versions('project', Project.objects.values_list('pk', flat=True))
+        self.stdout.write('Updated bid stats for %s projects.\n' % cursor.rowcount)
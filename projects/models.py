@@ -1,11 +1,85 @@
+import logging
+import random
+import threading
+from contextlib import contextmanager
+
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.db import connection
 from django.db import models
-
-from opentok import OpenTokSDK
+from django.db import transaction
+from django.db.models import F
+from django.db.models import Max
+from django.db.models import Q
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
 
 from users.models import Student
 from users.models import Tutor
+from users.models import UserProfile
+
+from . import chat
+from .cache_versions import bump_version
+from .pagination import keyset_paginate
+from .search import get_term_weights
+from .tokbox import create_session_id
+from .tokbox import record_metric
+
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def commit_on_success_unless_managed():
+    """Runs a block in its own transaction, unless the caller is managing
+    one, in which case the caller commits or rolls back the block's work.
+
+    commit_on_success inside a managed transaction would commit the caller's
+    work along with the block's.
+    """
+    if transaction.is_managed():
+        yield
+    else:
+        try:
+            with transaction.commit_on_success():
+                yield
+        finally:
+            run_after_commit_calls()
+
+
+_after_commit = threading.local()
+
+
+def after_commit(func, *args):
+    """Calls func(*args) now and, if a transaction is being managed, again
+    once it has committed.
+
+    This is for invalidating caches. A request that reads the old rows
+    before the transaction commits could cache them again, so the cache is
+    invalidated a second time once the changes are visible. The repeat
+    calls are made when the outermost commit_on_success_unless_managed
+    block ends, or else when the request finishes.
+    """
+    func(*args)
+    if transaction.is_managed():
+        calls = getattr(_after_commit, 'calls', None)
+        if calls is None:
+            calls = _after_commit.calls = []
+        if (func, args) not in calls:
+            calls.append((func, args))
+
+
+@receiver(request_finished)
+def run_after_commit_calls(**kwargs):
+    """Makes the calls after_commit put off in this thread."""
+    calls = getattr(_after_commit, 'calls', None)
+    _after_commit.calls = []
+    for func, args in calls or ():
+        func(*args)
 
 
 class Category(models.Model):
@@ -15,12 +89,34 @@ class Category(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
 
+    # Cache key for the list of all categories
+    list_cache_key = 'projects:categories'
+
     class Meta:
         verbose_name_plural = 'categories'
 
     def __unicode__(self):
         return self.title
 
+    @classmethod
+    def get_cached_list(cls):
+        """Returns a list of all categories.
+
+        Categories rarely change but are listed on every browse page, so the
+        list is cached until a category is saved or deleted.
+        """
+        categories = cache.get(cls.list_cache_key)
+        if categories is None:
+            categories = list(cls.objects.all())
+            cache.set(cls.list_cache_key, categories)
+        return categories
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def clear_category_list_cache(sender, **kwargs):
+    cache.delete(Category.list_cache_key)
+
 
 class ProjectFile(models.Model):
     """Supporting files for projects."""
@@ -50,6 +146,11 @@ class RequiredSkill(models.Model):
         return self.name
 
 
+class AwardError(Exception):
+    """Raised when a project can't be awarded to a bid."""
+    pass
+
+
 class Project(models.Model):
     """A project posted by a student looking for a tutor."""
     student = models.ForeignKey(Student, related_name='projects')
@@ -77,26 +178,135 @@ class Project(models.Model):
                                      editable=False,
                                      help_text="Has this project been awarded "
                                                "to a tutor?")
+    awarded_tutor = models.ForeignKey(Tutor, blank=True, null=True,
+                                      editable=False,
+                                      related_name='awarded_projects',
+                                      on_delete=models.SET_NULL,
+                                      help_text="The tutor whose bid was "
+                                                "awarded. Kept in sync by Bid.")
     completed = models.BooleanField(default=False,
                                     help_text="Closes the project and marks it \
                                                as completed.")
+    bid_count = models.PositiveIntegerField(default=0,
+                                            editable=False,
+                                            db_index=True,
+                                            help_text="Number of bids on this "
+                                                      "project. Kept in sync "
+                                                      "by Bid.")
+    last_bid_at = models.DateTimeField(blank=True, null=True,
+                                       editable=False,
+                                       db_index=True,
+                                       help_text="When the most recent bid "
+                                                 "was submitted.")
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
 
+    member_cache_key = 'projects:members:%s'
+    member_cache_timeout = 60 * 60 * 24
+
     def __unicode__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        """Saves the project, keeping the columns Bid maintains as they are
+        in the database.
+
+        Writing back the bid count, last bid time and awarded tutor loaded
+        with the project would undo any bid saved or awarded since, so they
+        are re-read with the row locked just before the UPDATE.
+        """
+        with commit_on_success_unless_managed():
+            if self.pk is not None and not kwargs.get('force_insert'):
+                rows = list(Project.objects.select_for_update().filter(
+                    pk=self.pk).values_list('bid_count', 'last_bid_at',
+                                            'awarded_tutor'))
+                if rows:
+                    self.bid_count, self.last_bid_at, tutor_id = rows[0]
+                    self.set_awarded_tutor(tutor_id)
+            return super(Project, self).save(*args, **kwargs)
+
     @models.permalink
     def get_absolute_url(self):
         return ('projects_view_detail', (), {'pk': self.pk})
 
-    def save(self, *args, **kwargs):
-        """Marks project as awarded if an awarded bid exists."""
-        if self.project_bids.filter(awarded=True).exists():
-            self.is_awarded = True
-        else:
-            self.is_awarded = False
-        return super(Project, self).save(*args, **kwargs)
+    @classmethod
+    def award(cls, project_id, bid_id, user):
+        """Awards a project to one of its bids and declines all the others.
+
+        The project's row is locked until the transaction ends, so two
+        awards arriving at once can't both find the project open. Raises
+        Project.DoesNotExist or Bid.DoesNotExist if either is missing and
+        AwardError if the user can't award the project or it isn't open.
+
+        Returns a dict describing the project's new state.
+        """
+        with commit_on_success_unless_managed():
+            project = cls.objects.select_for_update().select_related(
+                'student').get(pk=project_id)
+            if project.student.user_id != user.pk:
+                raise AwardError("You do not have permission to alter bids "
+                                 "on this project.")
+            if project.get_status() != "Open":
+                raise AwardError("Only open projects can be awarded.")
+            now = timezone.now()
+            bids = Bid.objects.filter(project=project)
+            awarded_bids = bids.filter(pk=bid_id)
+            tutor_ids = list(awarded_bids.values_list('tutor', flat=True))
+            if not tutor_ids:
+                raise Bid.DoesNotExist("Bid is not associated with project.")
+            awarded_bids.update(awarded=True, declined=False, modified=now)
+            competing_bids = bids.exclude(pk=bid_id).filter(declined=False)
+            declined_bid_ids = list(competing_bids.values_list('pk', flat=True))
+            competing_bids.update(awarded=False, declined=True, modified=now)
+            cls.objects.filter(pk=project.pk).update(
+                is_awarded=True, awarded_tutor=tutor_ids[0])
+            project.set_awarded_tutor(tutor_ids[0])
+        after_commit(bump_version, 'project', project.pk)
+        after_commit(cls.clear_member_cache, project.pk)
+        start_classroom_creation(project.pk)
+        return {'bid_id': int(bid_id),
+                'declined_bid_ids': declined_bid_ids,
+                'status': project.get_status()}
+
+    @classmethod
+    def decline_bids(cls, project_id, user, bid_ids=None):
+        """Declines several of a project's bids with a single UPDATE.
+
+        If bid_ids is None every bid except the awarded one is declined.
+        Awarded bids are never declined here. Raises Project.DoesNotExist if
+        the project is missing and AwardError if the user can't alter its
+        bids.
+
+        Returns a list of the ids of the bids that were declined.
+        """
+        with commit_on_success_unless_managed():
+            project = cls.objects.select_related('student').get(pk=project_id)
+            if project.student.user_id != user.pk:
+                raise AwardError("You do not have permission to alter bids "
+                                 "on this project.")
+            bids = Bid.objects.filter(project=project, awarded=False,
+                                      declined=False)
+            if bid_ids is not None:
+                bids = bids.filter(pk__in=[int(bid_id) for bid_id in bid_ids])
+            declined_bid_ids = list(bids.values_list('pk', flat=True))
+            if declined_bid_ids:
+                Bid.objects.filter(pk__in=declined_bid_ids).update(
+                    declined=True, modified=timezone.now())
+        return declined_bid_ids
+
+    def update_search_index(self):
+        """Replaces this project's search terms with ones built from its
+        current title, description and required skills.
+
+        This has to be called after the project and its required skills
+        have been saved.
+        """
+        skill_names = self.required_skills.values_list('name', flat=True)
+        weights = get_term_weights(self.title, self.description, skill_names)
+        self.search_terms.all().delete()
+        ProjectSearchTerm.objects.bulk_create([
+            ProjectSearchTerm(project=self, term=term, weight=weight)
+            for term, weight in weights.iteritems()])
 
     def get_budget_display(self):
         if self.budget > 0:
@@ -125,17 +335,71 @@ class Project(models.Model):
             return "Open"
         return "Closed"
 
+    def set_awarded_tutor(self, tutor_id):
+        """Updates this instance after its awarded tutor column is written.
+
+        Doesn't save anything.
+        """
+        self.is_awarded = tutor_id is not None
+        if tutor_id != self.awarded_tutor_id:
+            self.awarded_tutor_id = tutor_id
+            # Drop any tutor already fetched for the old id
+            self.__dict__.pop(self._meta.get_field('awarded_tutor').get_cache_name(), None)
+
     def get_tutor(self):
         """Projects can currently only have one tutor. If that changes this
         method will have to be replaced.
 
-        Returns None if this project has no tutor.
+        Returns None if this project has no tutor. The tutor is fetched at
+        most once per instance, or not at all if the project was fetched
+        with select_related('awarded_tutor').
         """
-        try:
-            tutor = self.project_bids.filter(awarded=True)[0].tutor
-        except IndexError:
-            return None
-        return tutor
+        return self.awarded_tutor
+
+    @classmethod
+    def get_member_ids(cls, project_id):
+        """Returns a frozenset of the ids of the users allowed into a
+        project's classroom: its student and its awarded tutor, if any.
+
+        The ids are cached until the project's award changes.
+        """
+        member_ids = cache.get(cls.member_cache_key % project_id)
+        if member_ids is None:
+            rows = list(cls.objects.filter(pk=project_id).values_list(
+                'student__user', 'awarded_tutor__user'))
+            user_ids = rows[0] if rows else ()
+            member_ids = cls.set_member_ids(project_id, *user_ids)
+        return member_ids
+
+    @classmethod
+    def set_member_ids(cls, project_id, *user_ids):
+        """Caches a project's member ids, leaving out missing ones."""
+        member_ids = frozenset(user_id for user_id in user_ids
+                               if user_id is not None)
+        cache.set(cls.member_cache_key % project_id, member_ids,
+                  cls.member_cache_timeout)
+        return member_ids
+
+    @classmethod
+    def clear_member_cache(cls, project_id):
+        cache.delete(cls.member_cache_key % project_id)
+
+
+class ProjectSearchTerm(models.Model):
+    """A word from a project's title, description or required skills.
+
+    Used by projects.search. The weight reflects how often and where the
+    word appears in the project.
+    """
+    project = models.ForeignKey('Project', related_name='search_terms')
+    term = models.CharField(max_length=50)
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = (('term', 'project'),)
+
+    def __unicode__(self):
+        return self.term
 
 
 class BidFile(models.Model):
@@ -183,6 +447,11 @@ class Bid(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
 
+    def __init__(self, *args, **kwargs):
+        super(Bid, self).__init__(*args, **kwargs)
+        # Lets save() tell whether the awarded flag has changed
+        self._loaded_awarded = self.awarded
+
     def __unicode__(self):
         return self.description
 
@@ -192,15 +461,64 @@ class Bid(models.Model):
         Budget type is only changed if budget_type doesn't have a value or
         if the update_budget_type argument is True, otherwise once it has
         been set it shouldn't be overridden.
+
+        The project's awarded status is only written when this bid's awarded
+        flag has changed since it was loaded, or when a new bid is saved
+        already awarded.
         """
         if update_budget_type or not self.budget_type:
             self.budget_type = self.project.budget_type
-        saved = super(Bid, self).save(*args, **kwargs)
-        if self.awarded and not self.project.is_awarded:
-            self.project.is_awarded = True
-            self.project.save()
+        is_new = self.pk is None
+        with commit_on_success_unless_managed():
+            saved = super(Bid, self).save(*args, **kwargs)
+            if is_new:
+                project = Project.objects.filter(pk=self.project_id)
+                # F() keeps concurrent bids from overwriting each other's count
+                project.update(bid_count=F('bid_count') + 1)
+                # A bid saved after a newer one mustn't move last_bid_at back
+                project.filter(Q(last_bid_at=None) |
+                               Q(last_bid_at__lt=self.created)).update(
+                    last_bid_at=self.created)
+            # A new bid starts out unawarded, whatever it was created with
+            awarded_changed = self.awarded != (False if is_new
+                                               else self._loaded_awarded)
+            if awarded_changed:
+                self.update_project_awarded_status()
+        self._loaded_awarded = self.awarded
+        if awarded_changed:
+            after_commit(Project.clear_member_cache, self.project_id)
+            if self.awarded:
+                start_classroom_creation(self.project_id)
         return saved
 
+    @classmethod
+    def get_awarded_tutor_id(cls, project_id):
+        """Returns the id of the tutor awarded a project, or None."""
+        tutor_ids = cls.objects.filter(project=project_id, awarded=True)
+        tutor_ids = tutor_ids.values_list('tutor', flat=True)[:1]
+        return tutor_ids[0] if tutor_ids else None
+
+    def update_project_awarded_status(self):
+        """Writes the project's is_awarded and awarded_tutor columns to match
+        this bid.
+
+        Only those columns are updated (saving the whole project would
+        overwrite columns like bid_count with whatever happened to be
+        loaded), and the project's other bids are only checked when this one
+        isn't awarded.
+        """
+        if self.awarded:
+            tutor_id = self.tutor_id
+        else:
+            tutor_id = Bid.get_awarded_tutor_id(self.project_id)
+        is_awarded = tutor_id is not None
+        Project.objects.filter(pk=self.project_id).update(
+            is_awarded=is_awarded, awarded_tutor=tutor_id)
+        # Keep an already loaded project in step without fetching it
+        project = getattr(self, self._meta.get_field('project').get_cache_name(), None)
+        if project is not None:
+            project.set_awarded_tutor(tutor_id)
+
     def get_budget_display(self):
         if self.budget > 0:
             budget = '$%s' % self.budget
@@ -219,6 +537,68 @@ class Bid(models.Model):
         return True
 
 
+@receiver(post_delete, sender=Bid)
+def update_project_bid_stats(sender, instance, **kwargs):
+    """Removes a deleted bid from its project's bid count.
+
+    The project's awarded status only has to be recalculated if the deleted
+    bid was awarded, and its last bid time only if the deleted bid was the
+    most recent one.
+    """
+    projects = Project.objects.filter(pk=instance.project_id)
+    projects.update(bid_count=F('bid_count') - 1)
+    if instance.awarded:
+        tutor_id = Bid.get_awarded_tutor_id(instance.project_id)
+        projects.update(is_awarded=tutor_id is not None,
+                        awarded_tutor=tutor_id)
+        after_commit(Project.clear_member_cache, instance.project_id)
+    projects.filter(last_bid_at=instance.created).update(
+        last_bid_at=Bid.objects.filter(project=instance.project_id).aggregate(
+            last_bid_at=Max('created'))['last_bid_at'])
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def bump_project_card_version(sender, instance, **kwargs):
+    after_commit(bump_version, 'project', instance.pk)
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def clear_project_member_cache(sender, instance, **kwargs):
+    after_commit(Project.clear_member_cache, instance.pk)
+
+
+@receiver(post_save, sender=Bid)
+@receiver(post_delete, sender=Bid)
+def bump_bid_project_card_version(sender, instance, **kwargs):
+    """A project's card shows its bid count and status."""
+    after_commit(bump_version, 'project', instance.project_id)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def bump_category_card_version(sender, instance, **kwargs):
+    after_commit(bump_version, 'category', instance.pk)
+
+
+@receiver(post_save, sender=User)
+def bump_user_card_version(sender, instance, **kwargs):
+    """Project cards show the name of their student."""
+    after_commit(bump_version, 'user', instance.pk)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_save, sender=Student)
+def bump_profile_card_version(sender, instance, **kwargs):
+    """Project cards link to the profile of their student.
+
+    Profiles are saved as either UserProfile or Student, depending on
+    whether they were fetched with get_profile.
+    """
+    after_commit(bump_version, 'user', instance.user_id)
+
+
 class Classroom(models.Model):
     """Chatrooms for projects.
     
@@ -229,9 +609,60 @@ class Classroom(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
 
+    # Number of chat messages loaded at a time
+    chat_history_length = 50
+
+    # A classroom's project never changes
+    project_cache_key = 'projects:classroom_project:%s'
+    project_cache_timeout = 60 * 60 * 24
+
     def __unicode__(self):
         return "Classroom for project: %s." % self.project
 
+    @classmethod
+    def get_project_id(cls, classroom_id):
+        """Returns the id of a classroom's project, or None if there's no
+        such classroom.
+
+        Caches the project's member ids at the same time if they aren't
+        already.
+        """
+        cache_key = cls.project_cache_key % classroom_id
+        project_id = cache.get(cache_key)
+        if project_id is None:
+            rows = list(cls.objects.filter(pk=classroom_id).values_list(
+                'project', 'project__student__user',
+                'project__awarded_tutor__user'))
+            if not rows:
+                return None
+            project_id, student_id, tutor_id = rows[0]
+            cache.set(cache_key, project_id, cls.project_cache_timeout)
+            if cache.get(Project.member_cache_key % project_id) is None:
+                Project.set_member_ids(project_id, student_id, tutor_id)
+        return project_id
+
+    @classmethod
+    def is_member(cls, classroom_id, user):
+        """Returns whether a user is the student or awarded tutor of a
+        classroom's project.
+
+        Once cached this takes two cache lookups and no queries, so it can
+        be used for every chat message.
+        """
+        project_id = cls.get_project_id(classroom_id)
+        if project_id is None:
+            return False
+        return user.pk in Project.get_member_ids(project_id)
+
+    def chat_history(self, cursor=None):
+        """Returns a KeysetPage of the classroom's chat messages.
+
+        The page holds the newest messages, or the ones older than cursor,
+        newest first. Its next_cursor() loads the messages before them.
+        """
+        return keyset_paginate(self.chat_entries.select_related('user'),
+                               self.chat_history_length, after=cursor)
+
     @classmethod
     def create(cls, project):
         """Handles classroom creation.
@@ -241,16 +672,111 @@ class Classroom(models.Model):
         """
         # Create a classroom for the supplied project instance
         classroom = cls(project=project)
-        # Create and assign a TokBox session
-        api_key = settings.TOKBOX_API_KEY
-        api_secret = settings.TOKBOX_API_SECRET
-        opentok_sdk = OpenTokSDK.OpenTokSDK(api_key, api_secret)
-        session_properties = {OpenTokSDK.SessionProperties.p2p_preference: "enabled"}
-        session = opentok_sdk.create_session(None, session_properties)
-        classroom.session_id = session.session_id
+        classroom.session_id = cls.get_session_id()
         classroom.save()
         return classroom
 
+    @classmethod
+    def get_or_create(cls, project):
+        """Returns a project's classroom, creating it if it doesn't exist.
+
+        Safe to call concurrently for the same project: the loser of a race
+        gets the winner's classroom instead of an IntegrityError, and puts
+        the session it got back in the pool.
+        """
+        try:
+            return cls.objects.get(project=project)
+        except cls.DoesNotExist:
+            pass
+        session_id = cls.get_session_id()
+        classroom, created = cls.objects.get_or_create(
+            project=project, defaults={'session_id': session_id})
+        if not created:
+            TokboxSession.release(session_id)
+        return classroom
+
+    @staticmethod
+    def get_session_id():
+        """Returns a TokBox session id, preferably one created ahead of time."""
+        session_id = TokboxSession.claim()
+        if session_id is None:
+            record_metric('SessionPool/Misses', 1)
+            session_id = create_session_id()
+        return session_id
+
+
+def create_classroom(project_id):
+    """Creates a project's classroom if it doesn't have one yet."""
+    try:
+        Classroom.get_or_create(Project.objects.get(pk=project_id))
+    except Exception:
+        # The classroom view creates the classroom if this fails
+        logger.exception("Couldn't create a classroom for project %s",
+                         project_id)
+    finally:
+        connection.close()
+
+
+def start_classroom_creation(project_id):
+    """Creates a newly awarded project's classroom in the background.
+
+    This takes the TokBox API call (if the session pool is empty) out of
+    the request that awarded the project. Set
+    CREATE_CLASSROOMS_IN_BACKGROUND to False to create it immediately.
+    """
+    if getattr(settings, 'CREATE_CLASSROOMS_IN_BACKGROUND', True):
+        thread = threading.Thread(target=create_classroom, args=(project_id,))
+        thread.daemon = True
+        thread.start()
+    else:
+        Classroom.get_or_create(Project.objects.get(pk=project_id))
+
+
+class TokboxSession(models.Model):
+    """TokBox sessions created ahead of time for new classrooms.
+
+    Creating a session is a request to the TokBox API, which can take
+    seconds. The fill_session_pool command keeps a supply of them so
+    classrooms don't have to wait for one.
+    """
+    session_id = models.CharField(max_length=100, unique=True)
+    claimed_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    # How many of the oldest unclaimed sessions to choose between, so
+    # concurrent claims don't all race for the same row
+    claim_candidates = 10
+
+    def __unicode__(self):
+        return self.session_id
+
+    @classmethod
+    def claim(cls):
+        """Marks an unclaimed session as claimed and returns its id.
+
+        Rows are claimed with a conditional UPDATE, so two requests can't
+        claim the same session. Returns None if the pool is empty.
+        """
+        unclaimed = cls.objects.filter(claimed_at=None)
+        candidates = list(unclaimed.order_by('pk').values_list(
+            'pk', 'session_id')[:cls.claim_candidates])
+        random.shuffle(candidates)
+        for pk, session_id in candidates:
+            if unclaimed.filter(pk=pk).update(claimed_at=timezone.now()):
+                record_metric('SessionPool/Claims', 1)
+                return session_id
+        return None
+
+    @classmethod
+    def release(cls, session_id):
+        """Returns a session that was claimed but not used to the pool.
+
+        Sessions created on a pool miss are added to it.
+        """
+        if not cls.objects.filter(session_id=session_id).update(
+                claimed_at=None):
+            cls.objects.create(session_id=session_id)
+
 
 class Chatlog(models.Model):
     """Stores text chat for project classrooms."""
@@ -261,3 +787,10 @@ class Chatlog(models.Model):
 
     def __unicode__(self):
         return self.message
+
+
+@receiver(post_save, sender=Chatlog)
+def publish_chat_message(sender, instance, created, **kwargs):
+    """Wakes the requests waiting for messages in the classroom."""
+    if created:
+        chat.channel.publish(instance.classroom_id, instance.pk)
@@ -0,0 +1,112 @@
+"""Keyset ("seek") pagination on (created, id).
+
+Offset pagination has to count the whole result set and skip over every
+earlier row to reach a page, which gets slower as tables grow. Keyset
+pagination instead asks for the rows just past the last one shown, which
+an index on (created, id) can answer directly however deep the page is.
+
+Cursors are the created timestamp and id of a row, e.g.
+'20130102153000123456-42'.
+"""
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+
+CURSOR_DATE_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+class InvalidCursor(Exception):
+    """Raised when a cursor can't be decoded."""
+    pass
+
+
+def encode_cursor(obj):
+    """Returns the cursor for a model instance."""
+    created = obj.created
+    if timezone.is_aware(created):
+        created = timezone.make_naive(created, timezone.utc)
+    return '%s-%s' % (created.strftime(CURSOR_DATE_FORMAT), obj.pk)
+
+
+def decode_cursor(cursor):
+    """Returns a (created, id) tuple from a cursor."""
+    try:
+        created, pk = cursor.split('-')
+        created = datetime.strptime(created, CURSOR_DATE_FORMAT)
+        pk = int(pk)
+    except (AttributeError, ValueError):
+        raise InvalidCursor("Invalid cursor: %r" % cursor)
+    if settings.USE_TZ:
+        created = timezone.make_aware(created, timezone.utc)
+    return created, pk
+
+
+class KeysetPage(object):
+    """A page of results from keyset_paginate.
+
+    object_list is always ordered newest first.
+    """
+
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def next_cursor(self):
+        """The cursor for the page of older results, or None if there isn't
+        one or this page is empty."""
+        if self.has_next and self.object_list:
+            return encode_cursor(self.object_list[-1])
+        return None
+
+    def previous_cursor(self):
+        """The cursor for the page of newer results, or None if there isn't
+        one or this page is empty."""
+        if self.has_previous and self.object_list:
+            return encode_cursor(self.object_list[0])
+        return None
+
+
+def keyset_paginate(queryset, per_page, after=None, before=None):
+    """Returns a KeysetPage of queryset ordered newest first.
+
+    after and before are cursors. With after the page holds the rows older
+    than the cursor, with before the rows newer than it, and with neither
+    the newest rows. One extra row is fetched to find out whether there is
+    another page in that direction, so no COUNT query is needed. A before
+    page also checks whether any rows are older than it.
+    """
+    if before is not None:
+        created, pk = decode_cursor(before)
+        older = queryset.filter(Q(created__lt=created) |
+                                Q(created=created, pk__lte=pk))
+        queryset = queryset.filter(Q(created__gt=created) |
+                                   Q(created=created, pk__gt=pk))
+        queryset = queryset.order_by('created', 'pk')
+    else:
+        if after is not None:
+            created, pk = decode_cursor(after)
+            queryset = queryset.filter(Q(created__lt=created) |
+                                       Q(created=created, pk__lt=pk))
+        queryset = queryset.order_by('-created', '-pk')
+    object_list = list(queryset[:per_page + 1])
+    has_more = len(object_list) > per_page
+    object_list = object_list[:per_page]
+    if before is not None:
+        object_list.reverse()
+        return KeysetPage(object_list, has_next=older.exists(),
+                          has_previous=has_more)
+    return KeysetPage(object_list, has_next=has_more,
+                      has_previous=after is not None)
@@ -0,0 +1,70 @@
+"""Project search backed by the ProjectSearchTerm table.
+
+Each project's title, description and required skills are split into
+words, and every distinct word is stored with a weight. Words in titles
+count for more than words in skills, which count for more than words in
+descriptions. A search ranks projects by the total weight of the words
+they share with the query.
+"""
+import re
+
+from django.db.models import Sum
+
+
+TITLE_WEIGHT = 3
+SKILL_WEIGHT = 2
+DESCRIPTION_WEIGHT = 1
+
+# Matches ProjectSearchTerm.term's max_length
+MAX_TERM_LENGTH = 50
+
+STOP_WORDS = frozenset(('a', 'an', 'and', 'are', 'as', 'at', 'be', 'but',
+                        'by', 'for', 'if', 'in', 'into', 'is', 'it', 'me',
+                        'my', 'no', 'not', 'of', 'on', 'or', 'so', 'such',
+                        'that', 'the', 'their', 'then', 'there', 'these',
+                        'they', 'this', 'to', 'was', 'will', 'with', 'i',
+                        'you', 'your', 'we', 'our'))
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """Returns the searchable words in text, lowercased."""
+    words = WORD_RE.findall(text.lower())
+    return [word[:MAX_TERM_LENGTH] for word in words
+            if len(word) > 1 and word not in STOP_WORDS]
+
+
+def get_term_weights(title, description, skill_names):
+    """Returns a dict of each searchable word in a project and its weight."""
+    weights = {}
+    sources = [(title, TITLE_WEIGHT), (description, DESCRIPTION_WEIGHT)]
+    sources.extend((name, SKILL_WEIGHT) for name in skill_names)
+    for text, weight in sources:
+        for term in tokenize(text):
+            weights[term] = weights.get(term, 0) + weight
+    return weights
+
+
+def filter_projects(queryset, query):
+    """Filters a Project queryset to the projects matching query.
+
+    A project is joined once for each matching word, so the result holds
+    duplicates unless it's grouped. A query without any searchable words
+    matches nothing.
+    """
+    terms = set(tokenize(query))
+    if not terms:
+        return queryset.none()
+    return queryset.filter(search_terms__term__in=terms)
+
+
+def search_projects(queryset, query):
+    """Filters a Project queryset to the projects matching query.
+
+    Matching projects are annotated with search_rank and ordered by it,
+    highest first.
+    """
+    queryset = filter_projects(queryset, query)
+    queryset = queryset.annotate(search_rank=Sum('search_terms__weight'))
+    return queryset.order_by('-search_rank', '-created', '-id')
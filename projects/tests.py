@@ -0,0 +1,1259 @@
+import csv
+import threading
+import time
+from StringIO import StringIO
+from datetime import timedelta
+
+from django.contrib.auth.models import Group
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import DEFAULT_DB_ALIAS
+from django.db import DatabaseError
+from django.db import connection
+from django.db import connections
+from django.db import reset_queries
+from django.db import transaction
+from django.http import Http404
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.utils import simplejson
+from django.utils import timezone
+
+from opentok import OpenTokSDK
+
+from users.models import Country
+from users.models import Student
+from users.models import Tutor
+
+from . import ajax
+from . import chat
+from . import chat_buffer
+from . import transcripts
+from .models import AwardError
+from .models import Bid
+from .models import Category
+from .models import Chatlog
+from .models import Classroom
+from .models import Project
+from .models import TokboxSession
+from .models import run_after_commit_calls
+from .pagination import encode_cursor
+from .pagination import keyset_paginate
+from .views import ProjectListView
+from . import tokbox
+
+
+def count_queries(func, *args, **kwargs):
+    """Calls func and returns the number of database queries it ran."""
+    old_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    # The test client resets the query log when a request starts
+    reset_queries()
+    try:
+        func(*args, **kwargs)
+    finally:
+        connection.use_debug_cursor = old_debug_cursor
+    return len(connection.queries)
+
+
+class FakeOpenTokSDK(object):
+    """Stands in for the TokBox API, counting the sessions created."""
+
+    def __init__(self):
+        self.sessions_created = 0
+        self.tokens_generated = 0
+
+    def create_session(self, location='', properties={}):
+        self.sessions_created += 1
+        return OpenTokSDK.OpenTokSession('api_session_%s'
+                                         % self.sessions_created)
+
+    def generate_token(self, session_id=None, role=None):
+        self.tokens_generated += 1
+        return 'token_%s_%s' % (session_id, self.tokens_generated)
+
+
+@override_settings(CREATE_CLASSROOMS_IN_BACKGROUND=False)
+class ProjectTestCase(TestCase):
+    """Creates a student, a tutor and a category for project tests.
+
+    Classrooms are created without a background thread, and TokBox sessions
+    come from a FakeOpenTokSDK.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.old_sdk = tokbox._opentok_sdk
+        tokbox._opentok_sdk = self.sdk = FakeOpenTokSDK()
+        self.student = self.create_profile(Student, 'student', 'Students')
+        self.tutor = self.create_profile(Tutor, 'tutor', 'Tutors')
+        self.category = Category.objects.create(title='Math')
+
+    def tearDown(self):
+        tokbox._opentok_sdk = self.old_sdk
+
+    def create_profile(self, profile_class, username, group_name):
+        user = User.objects.create_user(username, '%s@example.com' % username,
+                                        'password')
+        user.first_name = username.title()
+        user.save()
+        group, created = Group.objects.get_or_create(name=group_name)
+        user.groups.add(group)
+        return profile_class.objects.create(user=user)
+
+    def create_project(self, **kwargs):
+        defaults = {'student': self.student,
+                    'title': 'Algebra',
+                    'category': self.category,
+                    'description': 'Help with algebra.',
+                    'published': True}
+        defaults.update(kwargs)
+        return Project.objects.create(**defaults)
+
+    def create_bid(self, project, tutor=None, **kwargs):
+        defaults = {'project': project,
+                    'tutor': tutor or self.tutor,
+                    'description': 'I can help.',
+                    'budget': '10.00'}
+        defaults.update(kwargs)
+        return Bid.objects.create(**defaults)
+
+
+class BidStatsTest(ProjectTestCase):
+
+    def test_bid_stats_follow_bids(self):
+        project = self.create_project()
+        first_bid = self.create_bid(project)
+        second_bid = self.create_bid(project)
+        project = Project.objects.get(pk=project.pk)
+        self.assertEqual(project.bid_count, 2)
+        self.assertEqual(project.last_bid_at, second_bid.created)
+        second_bid.delete()
+        project = Project.objects.get(pk=project.pk)
+        self.assertEqual(project.bid_count, 1)
+        self.assertEqual(project.last_bid_at, first_bid.created)
+        first_bid.delete()
+        project = Project.objects.get(pk=project.pk)
+        self.assertEqual(project.bid_count, 0)
+        self.assertEqual(project.last_bid_at, None)
+
+    def test_last_bid_at_not_moved_back(self):
+        project = self.create_project()
+        later = timezone.now() + timedelta(minutes=1)
+        Project.objects.filter(pk=project.pk).update(last_bid_at=later)
+        self.create_bid(project)
+        project = Project.objects.get(pk=project.pk)
+        self.assertEqual(project.bid_count, 1)
+        self.assertEqual(project.last_bid_at, later)
+
+    def test_recount_bids(self):
+        project = self.create_project()
+        bid = self.create_bid(project)
+        Project.objects.update(bid_count=5, last_bid_at=None)
+        call_command('recount_bids', stdout=StringIO())
+        project = Project.objects.get(pk=project.pk)
+        self.assertEqual(project.bid_count, 1)
+        self.assertEqual(project.last_bid_at, bid.created)
+
+    def test_sort_by_bids(self):
+        quiet_project = self.create_project(title='Quiet')
+        busy_project = self.create_project(title='Busy')
+        self.create_bid(busy_project)
+        response = self.client.get(reverse('projects_browse'), {'o': 'bids'})
+        self.assertEqual(list(response.context['project_list']),
+                         [busy_project, quiet_project])
+
+
+class BidSaveTest(ProjectTestCase):
+    """Bid.save only touches the project when the awarded flag changes.
+
+    Before this was the case, saving an awarded bid took 6 queries (the
+    project was fetched, checked for awarded bids and fully re-saved) and
+    saving a project always checked its bids for an award.
+    """
+
+    def setUp(self):
+        super(BidSaveTest, self).setUp()
+        self.project = self.create_project()
+        self.bid = Bid.objects.get(pk=self.create_bid(self.project).pk)
+
+    def test_edit(self):
+        self.bid.description = 'I can really help.'
+        # Existence check and UPDATE for the bid
+        self.assertNumQueries(2, self.bid.save)
+
+    def test_award(self):
+        self.bid.awarded = True
+        # The bid's queries plus one UPDATE of the project's awarded status,
+        # then 5 to create the classroom, which outside tests happens in a
+        # background thread
+        self.assertNumQueries(3 + 5, self.bid.save)
+        self.assertTrue(Classroom.objects.filter(project=self.project).exists())
+        project = Project.objects.get(pk=self.project.pk)
+        self.assertTrue(project.is_awarded)
+        self.assertEqual(project.get_tutor(), self.tutor)
+        # Saving again isn't a transition, so the project is left alone
+        self.assertNumQueries(2, self.bid.save)
+
+    def test_create_awarded(self):
+        project = self.create_project(title='Geometry')
+        self.create_bid(project, awarded=True)
+        self.assertTrue(Classroom.objects.filter(project=project).exists())
+        project = Project.objects.get(pk=project.pk)
+        self.assertTrue(project.is_awarded)
+        self.assertEqual(project.get_tutor(), self.tutor)
+        self.assertTrue(self.tutor.user.pk in
+                        Project.get_member_ids(project.pk))
+
+    def test_unaward(self):
+        self.bid.awarded = True
+        self.bid.save()
+        self.bid.awarded = False
+        self.bid.declined = True
+        # The project's other bids are checked for an award before updating
+        self.assertNumQueries(4, self.bid.save)
+        project = Project.objects.get(pk=self.project.pk)
+        self.assertFalse(project.is_awarded)
+        self.assertEqual(project.get_tutor(), None)
+
+    def test_delete_awarded_bid(self):
+        self.bid.awarded = True
+        self.bid.save()
+        self.bid.delete()
+        project = Project.objects.get(pk=self.project.pk)
+        self.assertFalse(project.is_awarded)
+        self.assertEqual(project.get_tutor(), None)
+
+    def test_project_save(self):
+        project = Project.objects.get(pk=self.project.pk)
+        project.title = 'Linear Algebra'
+        # Re-reading the bid columns, then the existence check and UPDATE
+        # for the project, no bid lookups
+        self.assertNumQueries(3, project.save)
+
+    def test_project_save_keeps_bid_columns(self):
+        project = Project.objects.get(pk=self.project.pk)
+        self.bid.awarded = True
+        self.bid.save()
+        self.create_bid(self.project)
+        project.title = 'Linear Algebra'
+        project.save()
+        self.assertTrue(project.is_awarded)
+        project = Project.objects.get(pk=self.project.pk)
+        self.assertEqual(project.title, 'Linear Algebra')
+        self.assertEqual(project.bid_count, 2)
+        self.assertTrue(project.is_awarded)
+        self.assertEqual(project.get_tutor(), self.tutor)
+
+
+class AwardTest(ProjectTestCase):
+
+    def setUp(self):
+        super(AwardTest, self).setUp()
+        self.project = self.create_project()
+        self.bid = self.create_bid(self.project)
+        self.other_tutor = self.create_profile(Tutor, 'other', 'Tutors')
+        self.other_bid = self.create_bid(self.project, tutor=self.other_tutor)
+
+    def award(self, user=None):
+        return Project.award(self.project.pk, self.bid.pk,
+                             user or self.student.user)
+
+    def test_award(self):
+        # Lock, bid lookup and update, competing bid lookup and update,
+        # project update, then 5 to create the classroom as above
+        with self.assertNumQueries(6 + 5):
+            state = self.award()
+        self.assertEqual(state, {'bid_id': self.bid.pk,
+                                 'declined_bid_ids': [self.other_bid.pk],
+                                 'status': 'Awarded'})
+        project = Project.objects.get(pk=self.project.pk)
+        self.assertTrue(project.is_awarded)
+        self.assertEqual(project.get_tutor(), self.tutor)
+        self.assertTrue(Bid.objects.get(pk=self.bid.pk).awarded)
+        other_bid = Bid.objects.get(pk=self.other_bid.pk)
+        self.assertTrue(other_bid.declined)
+        self.assertFalse(other_bid.awarded)
+
+    def test_get_tutor(self):
+        self.award()
+        project = Project.objects.select_related('awarded_tutor__user').get(
+            pk=self.project.pk)
+        self.assertNumQueries(0, lambda: project.get_tutor().user)
+
+    def test_award_twice(self):
+        self.award()
+        self.assertRaises(AwardError, Project.award, self.project.pk,
+                          self.other_bid.pk, self.student.user)
+        self.assertFalse(Bid.objects.get(pk=self.other_bid.pk).awarded)
+
+    def test_award_by_other_user(self):
+        self.assertRaises(AwardError, self.award, self.tutor.user)
+        self.assertFalse(Project.objects.get(pk=self.project.pk).is_awarded)
+
+    def test_award_bid_from_other_project(self):
+        other_project = self.create_project(title='Geometry')
+        other_project_bid = self.create_bid(other_project)
+        self.assertRaises(Bid.DoesNotExist, Project.award, self.project.pk,
+                          other_project_bid.pk, self.student.user)
+        self.assertFalse(Project.objects.get(pk=self.project.pk).is_awarded)
+
+
+class DeclineBidsTest(ProjectTestCase):
+
+    def setUp(self):
+        super(DeclineBidsTest, self).setUp()
+        self.project = self.create_project()
+        self.bids = [self.create_bid(self.project) for i in range(3)]
+
+    def assertDeclined(self, bids):
+        declined = Bid.objects.filter(project=self.project, declined=True)
+        self.assertEqual(set(declined), set(bids))
+
+    def test_decline_selected(self):
+        bid_ids = [self.bids[0].pk, self.bids[1].pk]
+        # Project lookup, bid lookup and a single UPDATE
+        with self.assertNumQueries(3):
+            declined_bid_ids = Project.decline_bids(self.project.pk,
+                                                    self.student.user,
+                                                    bid_ids)
+        self.assertEqual(set(declined_bid_ids), set(bid_ids))
+        self.assertDeclined(self.bids[:2])
+
+    def test_decline_all_except_awarded(self):
+        awarded_bid = self.bids[0]
+        awarded_bid.awarded = True
+        awarded_bid.save()
+        declined_bid_ids = Project.decline_bids(self.project.pk,
+                                                self.student.user)
+        self.assertEqual(set(declined_bid_ids),
+                         set(bid.pk for bid in self.bids[1:]))
+        self.assertDeclined(self.bids[1:])
+
+    def test_decline_other_projects_bids(self):
+        other_bid = self.create_bid(self.create_project(title='Geometry'))
+        declined_bid_ids = Project.decline_bids(self.project.pk,
+                                                self.student.user,
+                                                [other_bid.pk])
+        self.assertEqual(declined_bid_ids, [])
+        self.assertFalse(Bid.objects.get(pk=other_bid.pk).declined)
+
+    def test_decline_by_other_user(self):
+        self.assertRaises(AwardError, Project.decline_bids, self.project.pk,
+                          self.tutor.user)
+        self.assertDeclined([])
+
+
+class ProjectListViewTest(ProjectTestCase):
+
+    def count_browse_queries(self):
+        """Returns the number of queries used to render the browse page."""
+        return count_queries(self.client.get, reverse('projects_browse'))
+
+    def test_constant_queries(self):
+        """Rendering the browse page doesn't cost queries per project."""
+        project = self.create_project()
+        self.create_bid(project)
+        # The first request caches the category list
+        self.count_browse_queries()
+        single_page_queries = self.count_browse_queries()
+        for i in range(5):
+            project = self.create_project(title='Geometry %s' % i)
+            self.create_bid(project)
+        self.assertEqual(self.count_browse_queries(), single_page_queries)
+
+    def test_facet_counts(self):
+        science = Category.objects.create(title='Science')
+        self.create_project()
+        self.create_project(is_awarded=True)
+        self.create_project(category=science, completed=True, is_awarded=True)
+        self.create_project(category=science, published=False)
+        response = self.client.get(reverse('projects_browse'))
+        self.assertEqual(response.context['category_facets'],
+                         [(self.category, 2), (science, 1)])
+        self.assertEqual(response.context['status_counts'],
+                         {'open': 1, 'awarded': 2, 'closed': 1, 'all': 3})
+
+        # Each facet's counts are narrowed by the other's filter
+        response = self.client.get(reverse('projects_browse'),
+                                   {'c': science.pk, 's': 'awarded'})
+        self.assertEqual(response.context['category_facets'],
+                         [(self.category, 1), (science, 1)])
+        self.assertEqual(response.context['status_counts'],
+                         {'open': 0, 'awarded': 1, 'closed': 1, 'all': 1})
+
+    def test_facet_counts_with_search(self):
+        project = self.create_project(title='Calculus')
+        project.required_skills.create(name='Calculus limits')
+        project.update_search_index()
+        self.create_project().update_search_index()
+        response = self.client.get(reverse('projects_browse'),
+                                   {'q': 'calculus limits'})
+        self.assertEqual(response.context['category_facets'],
+                         [(self.category, 1)])
+        self.assertEqual(response.context['status_counts']['all'], 1)
+
+    def test_dashboard_facet_counts(self):
+        """Dashboard facets only count the user's own projects."""
+        other_student = self.create_profile(Student, 'other', 'Students')
+        own_project = self.create_project()
+        self.create_project(student=other_student, is_awarded=True)
+        self.create_bid(own_project)
+        self.client.login(username='student', password='password')
+        response = self.client.get(reverse('users_dashboard'))
+        self.assertEqual(response.context['category_facets'],
+                         [(self.category, 1)])
+        self.assertEqual(response.context['status_counts'],
+                         {'open': 1, 'awarded': 0, 'closed': 0, 'all': 1})
+        self.client.login(username='tutor', password='password')
+        response = self.client.get(reverse('users_dashboard'))
+        self.assertEqual(response.context['status_counts']['all'], 1)
+
+    def test_cached_categories(self):
+        """Categories are cached until one is saved."""
+        self.client.get(reverse('projects_browse'))
+        filtered_queries = count_queries(self.client.get,
+                                         reverse('projects_browse'),
+                                         {'c': self.category.pk})
+        self.assertEqual(self.count_browse_queries(), filtered_queries)
+        science = Category.objects.create(title='Science')
+        response = self.client.get(reverse('projects_browse'),
+                                   {'c': science.pk})
+        self.assertEqual(response.context['search_category'], science)
+
+
+class ProjectDetailViewTest(ProjectTestCase):
+
+    def setUp(self):
+        super(ProjectDetailViewTest, self).setUp()
+        self.project = self.create_project()
+        self.country = Country.objects.create(name='Canada')
+        self.client.login(username='student', password='password')
+
+    def add_bid(self, username):
+        tutor = self.create_profile(Tutor, username, 'Tutors')
+        tutor.country = self.country
+        tutor.save()
+        bid = self.create_bid(self.project, tutor)
+        bid.bid_files.create(bid_file='bid_files/%s.pdf' % username)
+        return bid
+
+    def count_detail_queries(self):
+        return count_queries(self.client.get, reverse(
+            'projects_view_detail', kwargs={'pk': self.project.pk}))
+
+    def test_constant_queries(self):
+        """The owner's bid list doesn't cost queries per bid."""
+        self.add_bid('tutor1')
+        # The first request caches the user's role
+        self.count_detail_queries()
+        single_bid_queries = self.count_detail_queries()
+        for i in range(2, 6):
+            self.add_bid('tutor%s' % i)
+        self.assertEqual(self.count_detail_queries(), single_bid_queries)
+
+    def test_bid_details(self):
+        self.add_bid('tutor1')
+        response = self.client.get(reverse(
+            'projects_view_detail', kwargs={'pk': self.project.pk}))
+        self.assertContains(response, 'bid_files/tutor1.pdf')
+        self.assertContains(response, 'Canada')
+
+
+class CardCacheTest(ProjectTestCase):
+
+    def browse(self):
+        return self.client.get(reverse('projects_browse')).content
+
+    def test_cached_card(self):
+        project = self.create_project(title='Algebra')
+        # The test's transaction is managed, so this stands in for the
+        # commit, after which the project's version is bumped again
+        run_after_commit_calls()
+        self.browse()
+        # Queryset updates don't send signals, so the cached card is kept
+        Project.objects.filter(pk=project.pk).update(title='Geometry')
+        self.assertTrue('Algebra' in self.browse())
+
+    def test_project_change(self):
+        project = self.create_project(title='Algebra')
+        self.browse()
+        project.title = 'Geometry'
+        project.save()
+        self.assertTrue('Geometry' in self.browse())
+
+    def test_card_cached_before_commit(self):
+        """A card cached from rows read before a change committed is
+        replaced once it has."""
+        project = self.create_project(title='Algebra')
+        project.title = 'Geometry'
+        project.save()
+        # As by a request that read the project before the save committed
+        Project.objects.filter(pk=project.pk).update(title='Algebra')
+        self.assertTrue('Algebra' in self.browse())
+        Project.objects.filter(pk=project.pk).update(title='Geometry')
+        run_after_commit_calls()
+        self.assertTrue('Geometry' in self.browse())
+
+    def test_bid_change(self):
+        project = self.create_project()
+        self.browse()
+        self.create_bid(project)
+        self.assertTrue('Bids: 1' in self.browse())
+
+    def test_award(self):
+        project = self.create_project()
+        bid = self.create_bid(project)
+        self.browse()
+        Project.award(project.pk, bid.pk, self.student.user)
+        self.assertTrue('Status: Awarded' in self.browse())
+
+    def test_category_change(self):
+        self.create_project()
+        self.browse()
+        self.category.title = 'Mathematics'
+        self.category.save()
+        self.assertTrue('Mathematics' in self.browse())
+
+    def test_student_change(self):
+        self.create_project()
+        self.browse()
+        self.student.user.first_name = 'Ada'
+        self.student.user.save()
+        self.assertTrue('Ada' in self.browse())
+
+
+class KeysetPaginationTest(ProjectTestCase):
+
+    def setUp(self):
+        super(KeysetPaginationTest, self).setUp()
+        self.projects = [self.create_project(title='Project %s' % i)
+                         for i in range(8)]
+        # Newest first, as the browse page lists them
+        self.projects.reverse()
+
+    def browse(self, **params):
+        return self.client.get(reverse('projects_browse'), params)
+
+    def test_keyset_pages(self):
+        first_page = self.browse(page=1)
+        self.assertEqual(list(first_page.context['project_list']),
+                         self.projects[:6])
+        cursor = encode_cursor(self.projects[5])
+        older_page = self.browse(after=cursor)
+        self.assertEqual(list(older_page.context['project_list']),
+                         self.projects[6:])
+        self.assertEqual(older_page.context['paginator'], None)
+        self.assertFalse('older_page_url' in older_page.context)
+        newer_page = self.browse(before=encode_cursor(self.projects[6]))
+        self.assertEqual(list(newer_page.context['project_list']),
+                         self.projects[:6])
+        self.assertFalse('newer_page_url' in newer_page.context)
+
+    def test_keyset_page_keeps_filters(self):
+        self.projects[7].completed = True
+        self.projects[7].save()
+        response = self.browse(after=encode_cursor(self.projects[5]), s='open')
+        self.assertEqual(list(response.context['project_list']),
+                         self.projects[6:7])
+
+    def test_newer_page_has_older_link(self):
+        response = self.browse(before=encode_cursor(self.projects[7]))
+        self.assertEqual(list(response.context['project_list']),
+                         self.projects[1:7])
+        self.assertEqual(response.context['older_page_url'],
+                         '?after=%s' % encode_cursor(self.projects[6]))
+        self.assertEqual(response.context['newer_page_url'],
+                         '?before=%s' % encode_cursor(self.projects[1]))
+
+    def test_empty_older_page(self):
+        response = self.browse(after='19700101000000000000-1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['project_list']), [])
+        self.assertFalse('newer_page_url' in response.context)
+        self.assertFalse('older_page_url' in response.context)
+
+    def test_empty_newer_page(self):
+        response = self.browse(before='29991231000000000000-1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['project_list']), [])
+        self.assertFalse('newer_page_url' in response.context)
+        self.assertFalse('older_page_url' in response.context)
+        page = keyset_paginate(Project.objects.all(), 6,
+                               before='29991231000000000000-1')
+        self.assertTrue(page.has_next)
+        self.assertEqual(page.next_cursor(), None)
+        # Nothing is older than a page starting before every project
+        page = keyset_paginate(Project.objects.all(), 6,
+                               before='19700101000000000000-1')
+        self.assertFalse(page.has_next)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.browse(after='nonsense').status_code, 404)
+
+    def test_page_links(self):
+        response = self.browse()
+        self.assertEqual(response.context['page_links'], [1, 2])
+        self.assertFalse('older_page_url' in response.context)
+
+    def test_page_links_limit(self):
+        old_max_page_links = ProjectListView.max_page_links
+        ProjectListView.max_page_links = 1
+        try:
+            response = self.browse()
+        finally:
+            ProjectListView.max_page_links = old_max_page_links
+        self.assertEqual(response.context['page_links'], [1])
+        self.assertEqual(response.context['older_page_url'],
+                         '?after=%s' % encode_cursor(self.projects[5]))
+
+
+class SearchTest(ProjectTestCase):
+
+    def create_indexed_project(self, skills=(), **kwargs):
+        project = self.create_project(**kwargs)
+        for skill in skills:
+            project.required_skills.create(name=skill)
+        project.update_search_index()
+        return project
+
+    def search(self, query):
+        response = self.client.get(reverse('projects_browse'), {'q': query})
+        return list(response.context['project_list'])
+
+    def test_ranking(self):
+        title_match = self.create_indexed_project(title='Calculus tutoring')
+        skill_match = self.create_indexed_project(title='Homework',
+                                                  skills=['Calculus'])
+        description_match = self.create_indexed_project(
+            title='Exam prep', description='Mostly calculus.')
+        self.create_indexed_project(title='Chemistry')
+        self.assertEqual(self.search('calculus'),
+                         [title_match, skill_match, description_match])
+
+    def test_more_matching_words_rank_higher(self):
+        one_word = self.create_indexed_project(title='Linear equations')
+        both_words = self.create_indexed_project(title='Linear algebra')
+        self.assertEqual(self.search('linear algebra'), [both_words, one_word])
+
+    def test_index_follows_changes(self):
+        project = self.create_indexed_project(title='Physics',
+                                              skills=['Mechanics'])
+        self.assertEqual(self.search('mechanics'), [project])
+        project.required_skills.all().delete()
+        project.title = 'Optics'
+        project.save()
+        project.update_search_index()
+        self.assertEqual(self.search('mechanics'), [])
+        self.assertEqual(self.search('optics'), [project])
+
+    def test_stop_words_only(self):
+        self.create_indexed_project(title='The project')
+        self.assertEqual(self.search('the'), [])
+
+
+class SessionPoolTest(ProjectTestCase):
+
+    def fill(self, size):
+        call_command('fill_session_pool', size=size, stdout=StringIO())
+
+    def test_fill(self):
+        self.fill(3)
+        self.assertEqual(TokboxSession.objects.filter(claimed_at=None).count(), 3)
+        TokboxSession.claim()
+        self.fill(3)
+        self.assertEqual(self.sdk.sessions_created, 4)
+
+    def test_claim(self):
+        self.fill(2)
+        session_ids = set([TokboxSession.claim(), TokboxSession.claim()])
+        self.assertEqual(session_ids, set(['api_session_1', 'api_session_2']))
+        self.assertEqual(TokboxSession.claim(), None)
+
+    def test_classroom_uses_pool(self):
+        self.fill(1)
+        classroom = Classroom.create(self.create_project())
+        self.assertEqual(classroom.session_id, 'api_session_1')
+        self.assertEqual(self.sdk.sessions_created, 1)
+
+    def test_classroom_created_once(self):
+        project = self.create_project()
+        classroom = Classroom.get_or_create(project)
+        self.assertEqual(Classroom.get_or_create(project), classroom)
+        self.assertEqual(self.sdk.sessions_created, 1)
+
+    def test_classroom_race(self):
+        """The loser of a race to create a classroom returns its session to
+        the pool."""
+        self.fill(2)
+        project = self.create_project()
+        get_session_id = Classroom.get_session_id
+
+        def get_session_id_and_lose():
+            session_id = get_session_id()
+            Classroom.objects.create(project=project,
+                                     session_id=TokboxSession.claim())
+            return session_id
+        Classroom.get_session_id = staticmethod(get_session_id_and_lose)
+        try:
+            classroom = Classroom.get_or_create(project)
+        finally:
+            Classroom.get_session_id = staticmethod(get_session_id)
+        self.assertEqual(Classroom.objects.get(project=project), classroom)
+        # The session that wasn't used can be claimed again
+        self.assertEqual(set([classroom.session_id, TokboxSession.claim()]),
+                         set(['api_session_1', 'api_session_2']))
+
+    def test_release_unpooled_session(self):
+        TokboxSession.release('api_session_1')
+        self.assertEqual(TokboxSession.claim(), 'api_session_1')
+
+    def test_award_creates_classroom(self):
+        project = self.create_project()
+        bid = self.create_bid(project)
+        Project.award(project.pk, bid.pk, self.student.user)
+        self.assertEqual(Classroom.objects.get(project=project).session_id,
+                         'api_session_1')
+
+    def test_classroom_without_pool(self):
+        classroom = Classroom.create(self.create_project())
+        self.assertEqual(classroom.session_id, 'api_session_1')
+
+
+class ClassroomViewTest(ProjectTestCase):
+
+    def setUp(self):
+        super(ClassroomViewTest, self).setUp()
+        self.project = self.create_project()
+        bid = self.create_bid(self.project)
+        Project.award(self.project.pk, bid.pk, self.student.user)
+        self.url = reverse('projects_classroom',
+                           kwargs={'project_id': self.project.pk})
+
+    def get_token(self, username):
+        self.client.login(username=username, password='password')
+        return self.client.get(self.url).context['tokbox_token']
+
+    def test_token_reused_on_reload(self):
+        student_token = self.get_token('student')
+        self.assertEqual(self.get_token('student'), student_token)
+        self.assertEqual(self.sdk.tokens_generated, 1)
+        # Each user gets their own token
+        self.assertNotEqual(self.get_token('tutor'), student_token)
+
+    def add_messages(self, count):
+        classroom = Classroom.get_or_create(self.project)
+        for i in range(count):
+            classroom.chat_entries.create(user=self.student.user,
+                                          message='Message %s' % i)
+        return classroom
+
+    def test_latest_chat_history(self):
+        self.add_messages(Classroom.chat_history_length + 5)
+        self.client.login(username='student', password='password')
+        response = self.client.get(self.url)
+        messages = [m.message for m in response.context['chatlog']]
+        # Only the newest messages are shown, oldest first
+        self.assertEqual(messages, ['Message %s' % i for i in
+                                    range(5, Classroom.chat_history_length + 5)])
+        self.assertTrue(response.context['earlier_chat_cursor'])
+
+    def test_short_chat_history(self):
+        self.add_messages(3)
+        self.client.login(username='student', password='password')
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.context['chatlog']), 3)
+        self.assertEqual(response.context['earlier_chat_cursor'], None)
+
+    def test_load_earlier_messages(self):
+        length = Classroom.chat_history_length
+        classroom = self.add_messages(length * 2 + 5)
+        request = RequestFactory().get('/')
+        request.user = self.tutor.user
+        cursor = classroom.chat_history().next_cursor()
+        data = simplejson.loads(ajax.chat_history(request, classroom.pk,
+                                                  cursor))
+        self.assertTrue(data['messages_html'].find('Message 5<') <
+                        data['messages_html'].find('Message 6<'))
+        self.assertNotIn('Message %s<' % (length + 5), data['messages_html'])
+        data = simplejson.loads(ajax.chat_history(request, classroom.pk,
+                                                  data['earlier_cursor']))
+        self.assertIn('Message 0<', data['messages_html'])
+        self.assertNotIn('Message 5<', data['messages_html'])
+        self.assertEqual(data['earlier_cursor'], None)
+
+    def test_load_earlier_messages_queries(self):
+        classroom = self.add_messages(Classroom.chat_history_length * 3)
+        request = RequestFactory().get('/')
+        request.user = self.student.user
+        cursor = classroom.chat_history().next_cursor()
+        # The classroom's members, then the messages with their users
+        self.assertNumQueries(2, ajax.chat_history, request, classroom.pk,
+                              cursor)
+
+    def test_load_earlier_messages_permissions(self):
+        classroom = self.add_messages(1)
+        request = RequestFactory().get('/')
+        request.user = User.objects.create_user('other', 'other@example.com',
+                                                'password')
+        self.assertRaises(PermissionDenied, ajax.chat_history, request,
+                          classroom.pk, None)
+        request.user = self.student.user
+        self.assertRaises(Http404, ajax.chat_history, request, classroom.pk,
+                          'not-a-cursor')
+
+
+class MembershipTest(ProjectTestCase):
+
+    def setUp(self):
+        super(MembershipTest, self).setUp()
+        self.project = self.create_project()
+        self.bid = self.create_bid(self.project)
+        self.student_id = self.student.user.pk
+        self.tutor_id = self.tutor.user.pk
+
+    def award(self):
+        Project.award(self.project.pk, self.bid.pk, self.student.user)
+
+    def test_member_ids(self):
+        self.award()
+        self.assertEqual(Project.get_member_ids(self.project.pk),
+                         frozenset([self.student_id, self.tutor_id]))
+        self.assertNumQueries(0, Project.get_member_ids, self.project.pk)
+
+    def test_missing_project(self):
+        self.assertEqual(Project.get_member_ids(self.project.pk + 1),
+                         frozenset())
+
+    def test_cleared_by_award(self):
+        self.assertEqual(Project.get_member_ids(self.project.pk),
+                         frozenset([self.student_id]))
+        self.award()
+        self.assertIn(self.tutor_id, Project.get_member_ids(self.project.pk))
+
+    def test_cleared_by_declining_awarded_bid(self):
+        self.award()
+        classroom = Classroom.get_or_create(self.project)
+        self.assertTrue(Classroom.is_member(classroom.pk, self.tutor.user))
+        bid = Bid.objects.get(pk=self.bid.pk)
+        bid.awarded = False
+        bid.declined = True
+        bid.save()
+        self.assertFalse(Classroom.is_member(classroom.pk, self.tutor.user))
+        self.assertTrue(Classroom.is_member(classroom.pk, self.student.user))
+
+    def test_cleared_by_deleting_awarded_bid(self):
+        self.award()
+        self.assertIn(self.tutor_id, Project.get_member_ids(self.project.pk))
+        Bid.objects.get(pk=self.bid.pk).delete()
+        self.assertEqual(Project.get_member_ids(self.project.pk),
+                         frozenset([self.student_id]))
+
+    def test_cleared_again_after_commit(self):
+        """Members cached again before the award commits are cleared when
+        it does."""
+        self.bid.awarded = True
+        self.bid.save()
+        # As by a request that read the project before the award committed
+        Project.set_member_ids(self.project.pk, self.student_id)
+        # The test's transaction is managed, so this stands in for the end of
+        # the request that awarded the bid
+        run_after_commit_calls()
+        self.assertIn(self.tutor_id, Project.get_member_ids(self.project.pk))
+
+    def test_classroom_member(self):
+        self.award()
+        classroom = Classroom.get_or_create(self.project)
+        cache.clear()
+        # The classroom's project and members are looked up together
+        self.assertNumQueries(1, Classroom.is_member, classroom.pk,
+                              self.tutor.user)
+        self.assertNumQueries(0, Classroom.is_member, classroom.pk,
+                              self.student.user)
+        other = User.objects.create_user('other', 'other@example.com',
+                                         'password')
+        self.assertFalse(Classroom.is_member(classroom.pk, other))
+        self.assertFalse(Classroom.is_member(classroom.pk + 1, other))
+
+    def test_classroom_view_without_tutor(self):
+        self.award()
+        Bid.objects.get(pk=self.bid.pk).delete()
+        # Awarded again without a tutor, as by hand in the admin
+        Project.objects.filter(pk=self.project.pk).update(is_awarded=True)
+        Project.clear_member_cache(self.project.pk)
+        url = reverse('projects_classroom',
+                      kwargs={'project_id': self.project.pk})
+        self.client.login(username='tutor', password='password')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.login(username='student', password='password')
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class ChatChannelTest(TestCase):
+
+    def setUp(self):
+        self.channel = chat.ChatChannel()
+
+    def test_published_message(self):
+        self.channel.publish(1, 5)
+        self.assertTrue(self.channel.wait(1, 4, 0))
+        self.assertFalse(self.channel.wait(1, 5, 0))
+        # Other classrooms aren't affected
+        self.assertFalse(self.channel.wait(2, 0, 0))
+
+    def test_wakes_waiting_thread(self):
+        results = []
+        waiter = threading.Thread(
+            target=lambda: results.append(self.channel.wait(1, 0, 10)))
+        waiter.start()
+        time.sleep(0.05)
+        started = time.time()
+        self.channel.publish(1, 1)
+        waiter.join()
+        self.assertEqual(results, [True])
+        self.assertTrue(time.time() - started < 1)
+
+    def test_timeout(self):
+        started = time.time()
+        self.assertFalse(self.channel.wait(1, 0, 0.1))
+        self.assertTrue(time.time() - started >= 0.1)
+
+
+class ArrivingMessageChannel(object):
+    """Stands in for the chat channel, saving a message while it's waited on,
+    as another request would."""
+
+    def __init__(self, classroom, user):
+        self.classroom = classroom
+        self.user = user
+        self.waits = 0
+
+    def publish(self, classroom_id, message_id):
+        pass
+
+    def wait(self, classroom_id, after_id, timeout):
+        self.waits += 1
+        self.classroom.chat_entries.create(user=self.user, message='Hello')
+        return True
+
+
+@override_settings(CHAT_POLL_TIMEOUT=0.1)
+class ChatUpdatesTest(ProjectTestCase):
+
+    def setUp(self):
+        super(ChatUpdatesTest, self).setUp()
+        project = self.create_project()
+        bid = self.create_bid(project)
+        Project.award(project.pk, bid.pk, self.student.user)
+        self.classroom = Classroom.get_or_create(project)
+        self.url = reverse('projects_chat_updates',
+                           kwargs={'classroom_id': self.classroom.pk})
+        self.client.login(username='student', password='password')
+
+    def get_updates(self, after, seen=()):
+        response = self.client.get(self.url, {
+            'after': after, 'seen': ','.join(str(pk) for pk in seen)})
+        self.assertEqual(response.status_code, 200)
+        return simplejson.loads(response.content)
+
+    def settle(self, *messages):
+        settled = timezone.now() - timedelta(seconds=chat.SETTLE_TIME + 1)
+        Chatlog.objects.filter(pk__in=[m.pk for m in messages]).update(
+            created=settled)
+
+    def test_new_messages(self):
+        old = self.classroom.chat_entries.create(user=self.student.user,
+                                                 message='Old')
+        new = self.classroom.chat_entries.create(user=self.tutor.user,
+                                                 message='New')
+        data = self.get_updates(old.pk)
+        self.assertIn('New', data['messages_html'])
+        self.assertNotIn('Old', data['messages_html'])
+        # The new message is read again until it's settled
+        self.assertEqual(data['last_id'], old.pk)
+        self.settle(new)
+        self.assertEqual(self.get_updates(old.pk, [new.pk])['last_id'],
+                         new.pk)
+
+    def test_no_new_messages(self):
+        message = self.classroom.chat_entries.create(user=self.student.user,
+                                                     message='Old')
+        data = self.get_updates(message.pk)
+        self.assertEqual(data['last_id'], message.pk)
+        self.assertNotIn('chat-message', data['messages_html'])
+
+    def test_seen_messages_not_returned(self):
+        message = self.classroom.chat_entries.create(user=self.student.user,
+                                                     message='Hello')
+        data = self.get_updates(0, [message.pk])
+        self.assertNotIn('chat-message', data['messages_html'])
+        self.assertEqual(data['last_id'], 0)
+
+    def test_late_message_delivered(self):
+        # The first message was committed after the second was delivered
+        late = self.classroom.chat_entries.create(user=self.student.user,
+                                                  message='Late')
+        delivered = self.classroom.chat_entries.create(user=self.tutor.user,
+                                                       message='Delivered')
+        data = self.get_updates(0, [delivered.pk])
+        self.assertIn('Late', data['messages_html'])
+        self.assertNotIn('Delivered', data['messages_html'])
+
+    def test_settled_id_limited_to_returned_messages(self):
+        messages = [self.classroom.chat_entries.create(
+            user=self.student.user, message='Message %s' % i)
+            for i in range(chat.MAX_MESSAGES + 1)]
+        self.settle(*messages)
+        data = self.get_updates(0)
+        self.assertEqual(data['last_id'], messages[-2].pk)
+
+    def test_message_arrives_while_waiting(self):
+        old_channel = chat.channel
+        chat.channel = ArrivingMessageChannel(self.classroom, self.tutor.user)
+        try:
+            data = self.get_updates(0)
+        finally:
+            arriving, chat.channel = chat.channel, old_channel
+        self.assertEqual(arriving.waits, 1)
+        self.assertIn('Hello', data['messages_html'])
+
+    def test_saved_messages_are_published(self):
+        message = self.classroom.chat_entries.create(user=self.student.user,
+                                                     message='Hello')
+        self.assertTrue(chat.channel.wait(self.classroom.pk, message.pk - 1, 0))
+
+    def test_permissions(self):
+        User.objects.create_user('other', 'other@example.com', 'password')
+        self.client.login(username='other', password='password')
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class ChatBufferTest(ProjectTestCase):
+
+    def setUp(self):
+        super(ChatBufferTest, self).setUp()
+        project = self.create_project()
+        bid = self.create_bid(project)
+        Project.award(project.pk, bid.pk, self.student.user)
+        self.classroom = Classroom.get_or_create(project)
+        # Flushed by hand; the test database can't be used from another
+        # thread
+        self.buffer = chat_buffer.ChatBuffer(flush_interval=60)
+        self.request = RequestFactory().post('/')
+        self.request.user = self.student.user
+        self.old_buffer = ajax.chat_buffer
+        ajax.chat_buffer = self.buffer
+        self.old_channel = chat_buffer.channel
+        chat_buffer.channel = self.channel = chat.ChatChannel()
+
+    def tearDown(self):
+        self.buffer.stop()
+        ajax.chat_buffer = self.old_buffer
+        chat_buffer.channel = self.old_channel
+        super(ChatBufferTest, self).tearDown()
+
+    def send(self, message, classroom_id=None):
+        return simplejson.loads(ajax.chat_message(
+            self.request, classroom_id or self.classroom.pk, message))
+
+    def test_messages_saved_on_flush(self):
+        data = self.send('Hello')
+        self.assertIn('Hello', data['message_html'])
+        self.assertEqual(self.classroom.chat_entries.count(), 0)
+        self.send('Goodbye')
+        self.buffer.flush()
+        # SQLite's bulk inserts don't keep the order rows are given in
+        self.assertEqual(
+            sorted(self.classroom.chat_entries.values_list('user', 'message')),
+            [(self.student.user.pk, 'Goodbye'),
+             (self.student.user.pk, 'Hello')])
+        # The long polls are told about the saved messages
+        latest_id = self.classroom.chat_entries.latest('pk').pk
+        self.assertTrue(self.channel.wait(self.classroom.pk, latest_id - 1, 0))
+
+    def test_batched_inserts(self):
+        self.send('Hello')
+        # The newest id before any messages are saved, the INSERT and the
+        # latest id for the long polls
+        self.assertNumQueries(3, self.buffer.flush)
+        for i in range(chat_buffer.BATCH_SIZE + 1):
+            self.buffer.append(self.classroom.pk, self.student.user.pk,
+                               'Message %s' % i)
+        # Two INSERTs and the latest id for the long polls
+        self.assertNumQueries(3, self.buffer.flush)
+        self.assertEqual(self.classroom.chat_entries.count(),
+                         chat_buffer.BATCH_SIZE + 2)
+        self.assertNumQueries(0, self.buffer.flush)
+
+    def test_later_flushes_published(self):
+        self.send('Hello')
+        self.buffer.flush()
+        self.send('Goodbye')
+        self.buffer.flush()
+        latest_id = self.classroom.chat_entries.get(message='Goodbye').pk
+        self.assertEqual(self.channel.latest_ids[self.classroom.pk],
+                         latest_id)
+
+    def test_failed_flush_keeps_messages(self):
+        self.send('Hello')
+        bulk_create = Chatlog.objects.bulk_create
+        def fail(objs):
+            raise DatabaseError('Database unavailable')
+        Chatlog.objects.bulk_create = fail
+        try:
+            self.assertRaises(DatabaseError, self.buffer.flush)
+        finally:
+            Chatlog.objects.bulk_create = bulk_create
+        self.buffer.flush()
+        self.assertEqual(self.classroom.chat_entries.get().message, 'Hello')
+
+    def test_constraint_error_drops_only_bad_messages(self):
+        self.buffer.append(self.classroom.pk, self.student.user.pk, 'Hello')
+        self.buffer.append(self.classroom.pk, self.student.user.pk, None)
+        self.buffer.append(self.classroom.pk, self.tutor.user.pk, 'Goodbye')
+        self.buffer.flush()
+        self.assertEqual(
+            sorted(self.classroom.chat_entries.values_list('message',
+                                                           flat=True)),
+            ['Goodbye', 'Hello'])
+        self.assertEqual(self.buffer.messages, [])
+
+    def test_stop(self):
+        self.send('Hello')
+        thread = self.buffer.thread
+        self.buffer.stop()
+        self.assertFalse(thread.is_alive())
+        # The messages left are saved by the stopping thread
+        self.assertEqual(self.classroom.chat_entries.get().message, 'Hello')
+
+    def test_membership_cached(self):
+        # The classroom's members are looked up once
+        self.assertNumQueries(1, self.send, 'Hello')
+        self.assertNumQueries(0, self.send, 'Hello again')
+
+    def test_non_member(self):
+        self.request.user = User.objects.create_user(
+            'other', 'other@example.com', 'password')
+        self.assertRaises(PermissionDenied, self.send, 'Hello')
+        self.assertRaises(Http404, self.send, 'Hello', 'not-an-id')
+        self.buffer.flush()
+        self.assertEqual(self.classroom.chat_entries.count(), 0)
+
+
+class TranscriptTest(ProjectTestCase):
+
+    def setUp(self):
+        super(TranscriptTest, self).setUp()
+        project = self.create_project()
+        bid = self.create_bid(project)
+        Project.award(project.pk, bid.pk, self.student.user)
+        self.classroom = Classroom.get_or_create(project)
+        self.student.user.first_name = u'Zo\xeb'
+        self.student.user.last_name = u'Smith'
+        self.student.user.save()
+        User.objects.filter(pk=self.tutor.user.pk).update(first_name='')
+        self.client.login(username='student', password='password')
+
+    def get_transcript(self, format):
+        response = self.client.get(reverse(
+            'projects_classroom_transcript',
+            kwargs={'classroom_id': self.classroom.pk, 'format': format}))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def add_messages(self):
+        self.classroom.chat_entries.create(user=self.student.user,
+                                           message=u'Caf\xe9?')
+        self.classroom.chat_entries.create(user=self.tutor.user,
+                                           message='Sure, "at noon", ok')
+
+    def test_text(self):
+        self.add_messages()
+        lines = self.get_transcript('txt').content.decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].endswith(u'] Zo\xeb Smith: Caf\xe9?'))
+        # Users without a name are shown by username
+        self.assertTrue(lines[1].endswith('] tutor: Sure, "at noon", ok'))
+
+    def test_csv(self):
+        self.add_messages()
+        response = self.get_transcript('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.reader(StringIO(response.content)))
+        self.assertEqual(rows[0], ['id', 'time', 'name', 'message'])
+        self.assertEqual([row[2:] for row in rows[1:]],
+                         [[u'Zo\xeb Smith'.encode('utf-8'),
+                           u'Caf\xe9?'.encode('utf-8')],
+                          ['tutor', 'Sure, "at noon", ok']])
+
+    def test_empty_csv(self):
+        self.assertEqual(self.get_transcript('csv').content,
+                         'id,time,name,message\r\n')
+
+    def test_json_lines(self):
+        self.add_messages()
+        lines = self.get_transcript('jsonl').content.splitlines()
+        messages = [simplejson.loads(line) for line in lines]
+        self.assertEqual([(m['name'], m['message']) for m in messages],
+                         [(u'Zo\xeb Smith', u'Caf\xe9?'),
+                          (u'tutor', u'Sure, "at noon", ok')])
+
+    def test_permissions(self):
+        User.objects.create_user('other', 'other@example.com', 'password')
+        self.client.login(username='other', password='password')
+        response = self.client.get(reverse(
+            'projects_classroom_transcript',
+            kwargs={'classroom_id': self.classroom.pk, 'format': 'txt'}))
+        self.assertEqual(response.status_code, 403)
+
+    def test_connection_closed(self):
+        """The connection is closed once a transcript is sent, or when the
+        download is abandoned."""
+        self.add_messages()
+        closed = []
+        old_is_managed = transaction.is_managed
+        database = connections[DEFAULT_DB_ALIAS]
+        database.close = lambda: closed.append(True)
+        transaction.is_managed = lambda: False
+        try:
+            list(transcripts.generate_transcript(self.classroom, 'txt'))
+            self.assertEqual(len(closed), 1)
+            pieces = transcripts.generate_transcript(self.classroom, 'csv')
+            pieces.next()
+            self.assertEqual(len(closed), 1)
+            pieces.close()
+            self.assertEqual(len(closed), 2)
+        finally:
+            del database.close
+            transaction.is_managed = old_is_managed
+
+    def test_large_transcript_streamed(self):
+        count = 100 * transcripts.CHUNK_SIZE + 1
+        user_ids = [self.student.user.pk, self.tutor.user.pk]
+        # Small batches for SQLite's limit on query parameters
+        for start in range(0, count, 200):
+            Chatlog.objects.bulk_create([
+                Chatlog(classroom=self.classroom, user_id=user_ids[i % 2],
+                        message='Message %s' % i)
+                for i in range(start, min(start + 200, count))])
+        response = self.get_transcript('jsonl')
+        lines = 0
+        last_id = 0
+        largest_piece = 0
+        # The messages are read a chunk at a time as the response is
+        # iterated, each chunk with a single query
+        with self.assertNumQueries(101):
+            for piece in response:
+                largest_piece = max(largest_piece, len(piece))
+                for line in piece.splitlines():
+                    message_id = simplejson.loads(line)['id']
+                    self.assertNotEqual(message_id, last_id)
+                    last_id = message_id
+                    lines += 1
+        self.assertEqual(lines, count)
+        # No piece holds more than a chunk of messages
+        self.assertTrue(largest_piece < transcripts.CHUNK_SIZE * 200)
@@ -0,0 +1,74 @@
+"""The OpenTok SDK client shared by every request in the process.
+
+The SDK keeps connections to the OpenTok API open between requests, which
+only helps if the same instance is reused.
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+from opentok import OpenTokSDK
+
+try:
+    import newrelic.agent
+except ImportError:
+    newrelic = None
+
+
+# Tokens are valid for 24 hours, so a cached token always has at least 12
+# hours left
+TOKEN_CACHE_TIMEOUT = 60 * 60 * 12
+TOKEN_CACHE_KEY = 'tokbox:token:%s:%s:%s'
+
+_opentok_sdk = None
+_opentok_sdk_lock = threading.Lock()
+
+
+def get_opentok_sdk():
+    """Returns the process-wide OpenTokSDK instance.
+
+    TOKBOX_API_URL, TOKBOX_TIMEOUT and TOKBOX_RETRIES can optionally be set
+    to override the SDK's defaults.
+    """
+    global _opentok_sdk
+    if _opentok_sdk is None:
+        with _opentok_sdk_lock:
+            if _opentok_sdk is None:
+                _opentok_sdk = OpenTokSDK.OpenTokSDK(
+                    settings.TOKBOX_API_KEY,
+                    settings.TOKBOX_API_SECRET,
+                    api_url=getattr(settings, 'TOKBOX_API_URL', None),
+                    timeout=getattr(settings, 'TOKBOX_TIMEOUT',
+                                    OpenTokSDK.TIMEOUT),
+                    retries=getattr(settings, 'TOKBOX_RETRIES',
+                                    OpenTokSDK.RETRIES))
+    return _opentok_sdk
+
+
+def create_session_id():
+    """Creates a new OpenTok session for a classroom and returns its id."""
+    session_properties = {OpenTokSDK.SessionProperties.p2p_preference: "enabled"}
+    session = get_opentok_sdk().create_session(None, session_properties)
+    return session.session_id
+
+
+def get_token(session_id, user, role=OpenTokSDK.RoleConstants.PUBLISHER):
+    """Returns a token for a user to join a session.
+
+    Tokens are cached per session, user and role, so reloading a classroom
+    reuses the token from the first load.
+    """
+    key = TOKEN_CACHE_KEY % (session_id, user.pk, role)
+    token = cache.get(key)
+    if token is None:
+        token = get_opentok_sdk().generate_token(session_id, role)
+        cache.set(key, token, TOKEN_CACHE_TIMEOUT)
+    return token
+
+
+def record_metric(name, value):
+    """Records a custom New Relic metric, if the agent is installed."""
+    if newrelic is not None:
+        newrelic.agent.record_custom_metric('Custom/Tokbox/%s' % name, value,
+                                            newrelic.agent.application())
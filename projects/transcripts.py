@@ -0,0 +1,127 @@
+"""Classroom chat transcripts as plain text, CSV or JSON lines.
+
+Transcripts are generated a chunk of messages at a time, paging on
+(created, id) like projects.pagination, so exporting a classroom with any
+number of messages only ever holds one chunk in memory.
+
+They're generated while the response is sent, after the view has returned,
+so if the database fails partway through the download is cut short: the
+status and headers have already gone out, and the client gets a truncated
+file rather than an error.
+"""
+import csv
+from cStringIO import StringIO
+
+from django.db import connection
+from django.db import transaction
+from django.db.models import Q
+from django.utils import simplejson
+from django.utils import timezone
+
+
+# Messages fetched per query
+CHUNK_SIZE = 1000
+
+FORMATS = {
+    'txt': 'text/plain; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+MESSAGE_FIELDS = ('pk', 'created', 'user__username', 'user__first_name',
+                  'user__last_name', 'message')
+
+
+def iter_messages(classroom, chunk_size=CHUNK_SIZE):
+    """Yields (id, created, name, message) for a classroom's messages,
+    oldest first.
+
+    name is the sender's full name, or their username if they haven't
+    given one.
+    """
+    messages = classroom.chat_entries.order_by('created', 'pk')
+    messages = messages.values_list(*MESSAGE_FIELDS)
+    remaining = messages
+    while True:
+        count = 0
+        for pk, created, username, first_name, last_name, message in \
+                remaining[:chunk_size].iterator():
+            count += 1
+            name = (u'%s %s' % (first_name, last_name)).strip() or username
+            if timezone.is_aware(created):
+                yield pk, timezone.localtime(created), name, message
+            else:
+                yield pk, created, name, message
+        if count < chunk_size:
+            return
+        remaining = messages.filter(Q(created__gt=created) |
+                                    Q(created=created, pk__gt=pk))
+
+
+def iter_chunks(rows, chunk_size=CHUNK_SIZE):
+    """Groups rows into lists of chunk_size."""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def text_transcript(messages):
+    for chunk in iter_chunks(messages):
+        yield u''.join(u'[%s] %s: %s\n' % (
+            created.strftime('%Y-%m-%d %H:%M:%S'), name, message)
+            for pk, created, name, message in chunk).encode('utf-8')
+
+
+def csv_transcript(messages):
+    # Python 2's csv module only handles byte strings
+    def encode(value):
+        return unicode(value).encode('utf-8')
+    output = StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['id', 'time', 'name', 'message'])
+    for chunk in iter_chunks(messages):
+        for pk, created, name, message in chunk:
+            writer.writerow([pk, created.isoformat(), encode(name),
+                             encode(message)])
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+    if output.tell():
+        yield output.getvalue()
+
+
+def jsonl_transcript(messages):
+    for chunk in iter_chunks(messages):
+        yield ''.join(simplejson.dumps({'id': pk,
+                                        'time': created.isoformat(),
+                                        'name': name,
+                                        'message': message}) + '\n'
+                      for pk, created, name, message in chunk)
+
+
+TRANSCRIPT_WRITERS = {
+    'txt': text_transcript,
+    'csv': csv_transcript,
+    'jsonl': jsonl_transcript,
+}
+
+
+def generate_transcript(classroom, format):
+    """Yields the pieces of a classroom's transcript, as UTF-8 bytes, in one
+    of FORMATS.
+
+    The database connection is closed once the transcript is done or
+    abandoned, since it may have been reopened after the request's own
+    connection was closed.
+    """
+    try:
+        for piece in TRANSCRIPT_WRITERS[format](iter_messages(classroom)):
+            yield piece
+    finally:
+        if not transaction.is_managed():
+            connection.close()
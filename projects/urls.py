@@ -25,4 +25,10 @@ urlpatterns = patterns('projects.views',
                            name='projects_bid_edit'),
                        url(r'^classrooms/(?P<project_id>\d+)/$', 'classroom',
                            name='projects_classroom'),
+                       url(r'^classrooms/chat/(?P<classroom_id>\d+)/$',
+                           'chat_updates', name='projects_chat_updates'),
+                       url(r'^classrooms/transcript/(?P<classroom_id>\d+)\.'
+                           r'(?P<format>txt|csv|jsonl)$',
+                           'classroom_transcript',
+                           name='projects_classroom_transcript'),
                       )
@@ -3,21 +3,30 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse
+from django.db.models import Count
 from django.http import Http404
+from django.http import HttpResponse
 from django.http import HttpResponseRedirect
 from django.shortcuts import get_object_or_404
 from django.shortcuts import render_to_response
 from django.template import RequestContext
 from django.template.loader import render_to_string
+from django.utils import simplejson
 from django.views.generic import CreateView
 from django.views.generic import DetailView
 from django.views.generic import ListView
 from django.views.generic import UpdateView
 from django.utils.decorators import method_decorator
 
-from opentok import OpenTokSDK
 from stripe_connect.forms import StripeTransactionForm
-
+from users.models import get_user_role
+
+from .cache_versions import CARD_CACHE_TIMEOUT
+from .cache_versions import set_card_versions
+from .chat import MAX_MESSAGES
+from .chat import MAX_SEEN_IDS
+from .chat import get_new_messages
+from .chat import get_settled_id
 from .forms import BidForm
 from .forms import BidFileFormSet
 from .forms import ProjectForm
@@ -27,6 +36,15 @@ from .models import Bid
 from .models import Category
 from .models import Classroom
 from .models import Project
+from .pagination import InvalidCursor
+from .pagination import KeysetPage
+from .pagination import encode_cursor
+from .pagination import keyset_paginate
+from .search import filter_projects
+from .search import search_projects
+from .tokbox import get_token
+from .transcripts import FORMATS as TRANSCRIPT_FORMATS
+from .transcripts import generate_transcript
 
 
 class ProjectMixin(object):
@@ -76,6 +94,7 @@ class ProjectMixin(object):
         # Handle project files
         projectfile_formset.instance = self.object
         projectfile_formset.save()
+        self.object.update_search_index()
         return super(ProjectMixin, self).form_valid(form)
 
 
@@ -97,7 +116,7 @@ class ProjectCreateView(ProjectMixin, CreateView):
         dispatch = super(ProjectCreateView, self).dispatch(*args, **kwargs)
         # Make sure we're dealing with a student
         # TODO: Create and use permissions for this instead
-        if self.request.user.groups.filter(name='Students').exists():
+        if get_user_role(self.request.user) == 'Student':
             return dispatch
         raise PermissionDenied("Only students can create projects")
 
@@ -139,18 +158,41 @@ class ProjectListView(ListView):
     """
     context_object_name = 'project_list'
     paginate_by = 6
+    # Larger result sets only get this many page number links, after which
+    # they're browsed with keyset cursors
+    max_page_links = 10
+    # Querystring values for 'o' and the ordering they select
+    sort_orders = {'bids': ('-bid_count', '-created'),
+                   'activity': ('-last_bid_at', '-created')}
+    # Statuses from the querystring and the projects they select
+    status_filters = {'Open': {'completed': False, 'is_awarded': False},
+                      'Awarded': {'is_awarded': True},
+                      'Closed': {'completed': True}}
+
+    def get_base_queryset(self):
+        """The projects that are listed, and counted in the facets, before
+        any filters from the querystring.
+        """
+        return Project.objects.filter(published=True)
 
     def get_filtered_category(self):
         """
         Reurns a category based on the querystring or None if nothing is found.
+
+        The category is looked up in the cached category list once per
+        request.
         """
-        category_id = self.request.GET.get('c', None)
-        if category_id:
+        if not hasattr(self, '_filtered_category'):
+            self._filtered_category = None
             try:
-                return Category.objects.get(pk=category_id)
-            except (ValueError, Category.DoesNotExist):
-                pass
-        return None
+                category_id = int(self.request.GET.get('c', None))
+            except (TypeError, ValueError):
+                category_id = None
+            for category in Category.get_cached_list():
+                if category.pk == category_id:
+                    self._filtered_category = category
+                    break
+        return self._filtered_category
 
     def get_filtered_status(self):
         """The status requested in the querystring (if any)."""
@@ -159,10 +201,133 @@ class ProjectListView(ListView):
             return status.title()
         return None
 
+    def get_search_query(self):
+        """The search terms in the querystring (if any)."""
+        return self.request.GET.get('q', '').strip()
+
+    def get_filtered_sort(self):
+        """The sort order requested in the querystring (if it's valid)."""
+        sort = self.request.GET.get('o', None)
+        if sort in self.sort_orders:
+            return sort
+        return None
+
+    def get_ordering(self):
+        """Newest projects come first unless another sort is requested."""
+        sort = self.get_filtered_sort()
+        if sort:
+            return self.sort_orders[sort]
+        return ('-created', '-id')
+
+    def use_keyset_pagination(self):
+        """Keyset cursors are used if the querystring has one and projects
+        are in the default newest first order.
+        """
+        if self.get_filtered_sort() is not None or self.get_search_query():
+            return False
+        return 'after' in self.request.GET or 'before' in self.request.GET
+
+    def paginate_queryset(self, queryset, page_size):
+        """Paginates with keyset cursors instead of page numbers if needed.
+
+        Keyset pages don't have a paginator, since they never count the
+        whole result set.
+        """
+        if not self.use_keyset_pagination():
+            return super(ProjectListView, self).paginate_queryset(queryset,
+                                                                  page_size)
+        try:
+            page = keyset_paginate(queryset, page_size,
+                                   after=self.request.GET.get('after'),
+                                   before=self.request.GET.get('before'))
+        except InvalidCursor:
+            raise Http404
+        return (None, page, page.object_list, page.has_other_pages())
+
+    def get_pagination_context(self, paginator, page):
+        """Returns the links for moving between pages.
+
+        Page number links keep the filters from the querystring, and are
+        limited to max_page_links. Pages past that are reached through an
+        'older' keyset cursor instead.
+        """
+        querystring = self.request.GET.copy()
+        for key in ('page', 'after', 'before'):
+            querystring.pop(key, None)
+        context = {'pagination_querystring': querystring.urlencode()}
+
+        def cursor_url(key, cursor):
+            cursor_querystring = querystring.copy()
+            cursor_querystring[key] = cursor
+            return '?%s' % cursor_querystring.urlencode()
+
+        if isinstance(page, KeysetPage):
+            newer_cursor = page.previous_cursor()
+            if newer_cursor is not None:
+                context['newer_page_url'] = cursor_url('before', newer_cursor)
+            older_cursor = page.next_cursor()
+            if older_cursor is not None:
+                context['older_page_url'] = cursor_url('after', older_cursor)
+        elif paginator is not None:
+            context['page_links'] = paginator.page_range[:self.max_page_links]
+            if (paginator.num_pages > self.max_page_links and page.has_next()
+                    and self.get_filtered_sort() is None
+                    and not self.get_search_query()):
+                last_project = list(page.object_list)[-1]
+                context['older_page_url'] = cursor_url(
+                    'after', encode_cursor(last_project))
+        return context
+
+    def get_facet_counts(self):
+        """Returns the number of projects in each category and status.
+
+        Category counts are for projects with the requested status, and
+        status counts for projects in the requested category, so each count
+        is the number of projects that choosing it would list. Both come
+        from one query grouping the projects by category and status.
+        """
+        queryset = self.get_base_queryset()
+        if self.get_filtered_sort() == 'activity':
+            queryset = queryset.exclude(last_bid_at=None)
+        query = self.get_search_query()
+        if query:
+            queryset = filter_projects(queryset, query)
+        rows = queryset.values('category', 'is_awarded', 'completed')
+        rows = rows.annotate(count=Count('id', distinct=True)).order_by()
+
+        def has_status(row, status):
+            filters = self.status_filters.get(status, {})
+            return all(row[field] == value
+                       for field, value in filters.iteritems())
+
+        category = self.get_filtered_category()
+        status = self.get_filtered_status()
+        category_counts = {}
+        status_counts = dict.fromkeys(self.status_filters, 0)
+        status_counts['All'] = 0
+        for row in rows:
+            if has_status(row, status):
+                category_counts[row['category']] = (
+                    category_counts.get(row['category'], 0) + row['count'])
+            if category is None or row['category'] == category.pk:
+                for name in self.status_filters:
+                    if has_status(row, name):
+                        status_counts[name] += row['count']
+                status_counts['All'] += row['count']
+        return category_counts, status_counts
+
     def get_context_data(self, *args, **kwargs):
         context = super(ProjectListView, self).get_context_data(*args, **kwargs)
-        # Categories for filter list
-        context['categories'] = Category.objects.all()
+        # Categories for filter list, with the number of projects in each
+        categories = Category.get_cached_list()
+        category_counts, status_counts = self.get_facet_counts()
+        context['categories'] = categories
+        context['category_facets'] = [
+            (category, category_counts.get(category.pk, 0))
+            for category in categories]
+        context['category_count_total'] = sum(category_counts.values())
+        context['status_counts'] = dict((name.lower(), count) for name, count
+                                        in status_counts.iteritems())
         # Search criteria
         search_category = self.get_filtered_category()
         if search_category:
@@ -170,24 +335,44 @@ class ProjectListView(ListView):
         search_status = self.get_filtered_status()
         if search_status:
             context['search_status'] = search_status
+        context['search_sort'] = self.get_filtered_sort()
+        context['search_query'] = self.get_search_query()
+        # Project cards are cached until anything they show changes
+        projects = list(context['object_list'])
+        set_card_versions(projects)
+        context['object_list'] = context['project_list'] = projects
+        context['card_cache_timeout'] = CARD_CACHE_TIMEOUT
+        context.update(self.get_pagination_context(context['paginator'],
+                                                   context['page_obj']))
         return context
 
     def get_queryset(self):
-        """Handles extra filtering based on querystring."""
-        queryset = Project.objects.filter(published=True)
+        """Handles extra filtering and sorting based on querystring.
+
+        The student (and their user) and category are fetched along with the
+        projects so listing a page doesn't cost extra queries per row.
+        Searches are ordered by relevance unless another sort is requested.
+        """
+        queryset = self.get_base_queryset()
+        queryset = queryset.select_related('student__user', 'category')
         category = self.get_filtered_category()
         if category is not None:
             queryset = queryset.filter(category=category)
         status = self.get_filtered_status()
-        if status:
-            if status == 'Closed':
-                queryset = queryset.filter(completed=True)
-            elif status == 'Awarded':
-                queryset = queryset.filter(is_awarded=True)
-            elif status == 'Open':
-                queryset = queryset.filter(completed=False, is_awarded=False)
-
-        queryset = queryset.order_by('-created')
+        if status in self.status_filters:
+            queryset = queryset.filter(**self.status_filters[status])
+
+        if self.get_filtered_sort() == 'activity':
+            # Projects without bids have no activity to sort by
+            queryset = queryset.exclude(last_bid_at=None)
+
+        query = self.get_search_query()
+        if query:
+            queryset = search_projects(queryset, query)
+            if self.get_filtered_sort() is None:
+                return queryset
+
+        queryset = queryset.order_by(*self.get_ordering())
         return queryset
         
     def dispatch(self, *args, **kwargs):
@@ -204,7 +389,8 @@ class ProjectDetailView(DetailView):
     tutors only see their own bids.
     """
     context_object_name = 'project'
-    queryset = Project.objects.all()
+    queryset = Project.objects.select_related('student__user',
+                                              'awarded_tutor__user')
 
     def get_object(self, queryset=None):
         project = super(ProjectDetailView, self).get_object(queryset)
@@ -215,16 +401,31 @@ class ProjectDetailView(DetailView):
                 raise Http404()
         return project
 
+    def get_bid_list(self, bids):
+        """Fetches bids with everything the template shows for them.
+
+        Tutors come with their users and countries, and bid files are
+        prefetched, so the number of queries doesn't grow with the number
+        of bids.
+        """
+        bids = bids.select_related('tutor__user', 'tutor__country')
+        bids = list(bids.prefetch_related('bid_files').order_by('-created'))
+        for bid in bids:
+            # Saves looking the project up again for every bid
+            bid.project = self.object
+        return bids
+
     def get_context_data(self, **kwargs):
         context = super(ProjectDetailView, self).get_context_data(**kwargs)
         project = self.object
         user = self.request.user
         if project.student.user == user:
-            context['bid_list'] = project.project_bids.all().order_by('-created')
+            context['bid_list'] = self.get_bid_list(project.project_bids.all())
             context['stripe_payment_form'] = StripeTransactionForm()
             context['stripe_published_key'] = settings.STRIPE_PUBLISHABLE
         else:
-            context['bid_list'] = project.project_bids.filter(tutor__user=user).order_by('-created')
+            context['bid_list'] = self.get_bid_list(
+                project.project_bids.filter(tutor__user=user))
         return context
 
     @method_decorator(login_required)
@@ -306,7 +507,7 @@ def create_bid(request, project_id):
     user = request.user
     # Make sure we're dealing with a tutor
     # TODO: Create and use permissions for this instead
-    if user.groups.filter(name='Tutors').exists():
+    if get_user_role(user) == 'Tutor':
         tutor = user.get_profile().tutor
     else:
         raise PermissionDenied("Only tutors can submit bids.")
@@ -353,26 +554,24 @@ def classroom(request, project_id):
     if not project.is_awarded:
         raise PermissionDenied("Only awarded projects have classrooms.")
     user = request.user
-    project_student = project.student
-    project_tutor = project.get_tutor()
-    if project_student.user != user and project_tutor.user != user:
+    if user.pk not in Project.get_member_ids(project.pk):
         raise PermissionDenied("Only the project's student or tutor can join"
                                " this room.")
 
-    # Get or create the classroom for this project
-    try:
-        classroom = Classroom.objects.get(project=project)
-    except Classroom.DoesNotExist:
-        classroom = Classroom.create(project=project)
+    # The classroom is normally created when the project is awarded
+    classroom = Classroom.get_or_create(project)
 
-    # Get any archived chat messages
-    chatlog = classroom.chat_entries.order_by('created')
+    # Only the latest chat messages are loaded with the page; earlier ones
+    # are fetched with the chat_history ajax view as the user scrolls back
+    chat_page = classroom.chat_history()
+    chatlog = chat_page.object_list[::-1]
+    # New messages are long-polled for from the chat_updates view, starting
+    # from the oldest message shown so that ones committed late still arrive
+    last_chat_message_id = chatlog[0].pk - 1 if chatlog else 0
 
     # Create a TokBox auth token for this user
     api_key = settings.TOKBOX_API_KEY
-    api_secret = settings.TOKBOX_API_SECRET
-    opentok_sdk = OpenTokSDK.OpenTokSDK(api_key, api_secret)
-    token = opentok_sdk.generate_token(classroom.session_id)
+    token = get_token(classroom.session_id, user)
 
     return render_to_response('projects/classroom.html',
                               {'tokbox_session_id': classroom.session_id,
@@ -381,7 +580,69 @@ def classroom(request, project_id):
                                'classroom': classroom,
                                'project': project,
                                'chatlog': chatlog,
+                               'earlier_chat_cursor': chat_page.next_cursor(),
+                               'last_chat_message_id': last_chat_message_id,
                                'stripe_payment_form': StripeTransactionForm(),
                                'stripe_published_key': settings.STRIPE_PUBLISHABLE,
                               },
                               context_instance=RequestContext(request))
+
+
+@login_required
+def chat_updates(request, classroom_id):
+    """Long-polls for a classroom's chat messages.
+
+    Returns the messages newer than the 'after' message id, other than the
+    comma-separated 'seen' ids, as soon as there are any, or an empty list
+    once CHAT_POLL_TIMEOUT seconds have passed. The client asks again
+    straight away with the returned last_id, sending the ids it has above
+    that as 'seen'.
+    """
+    classroom_id = int(classroom_id)
+    if not Classroom.is_member(classroom_id, request.user):
+        raise PermissionDenied("Only the project's student or tutor can read"
+                               " this room's messages.")
+    # Reading the messages only needs the classroom's id
+    classroom = Classroom(pk=classroom_id)
+    try:
+        after_id = int(request.GET.get('after', 0))
+        seen_ids = [int(pk) for pk in request.GET.get('seen', '').split(',')
+                    if pk]
+    except ValueError:
+        raise Http404
+    # Any seen ids left out are just sent again
+    seen_ids = seen_ids[-MAX_SEEN_IDS:]
+    messages = get_new_messages(classroom, after_id, seen_ids)
+    # The client doesn't have the messages past the last one returned if
+    # there were more than fit in one response
+    up_to_id = None
+    if len(messages) == MAX_MESSAGES:
+        up_to_id = messages[-1].pk
+    messages_html = render_to_string('projects/chat_messages.html',
+                                     {'chatlog': messages})
+    return HttpResponse(simplejson.dumps({
+        'messages_html': messages_html,
+        'last_id': get_settled_id(classroom, after_id, up_to_id)}),
+        mimetype='application/json')
+
+
+@login_required
+def classroom_transcript(request, classroom_id, format):
+    """Downloads a classroom's chat transcript as txt, csv or jsonl.
+
+    The transcript is streamed as it's generated, so middleware that reads
+    the whole response, like GZipMiddleware, would undo the point of it. A
+    database error while streaming truncates the download; see
+    projects.transcripts.
+    """
+    classroom_id = int(classroom_id)
+    if not Classroom.is_member(classroom_id, request.user):
+        raise PermissionDenied("Only the project's student or tutor can read"
+                               " this room's messages.")
+    response = HttpResponse(generate_transcript(Classroom(pk=classroom_id),
+                                                format),
+                            mimetype=TRANSCRIPT_FORMATS[format])
+    response['Content-Disposition'] = (
+        'attachment; filename=classroom-%s-transcript.%s'
+        % (classroom_id, format))
+    return response
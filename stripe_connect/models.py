@@ -1,9 +1,17 @@
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.db import models
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 
 
 from projects.models import Project
 
+CONNECTED_CACHE_KEY = 'stripe_connect:connected:%s'
+CONNECTED_CACHE_TIMEOUT = 60 * 60 * 24
+
+
 class StripeAccessKey(models.Model):
     """Stripe access keys for tutors"""
     user = models.ForeignKey(User, unique=True)
@@ -13,6 +21,34 @@ class StripeAccessKey(models.Model):
         return self.access_key
 
 
+def is_stripe_connected(user):
+    """Returns True if the user has a StripeAccessKey.
+
+    The answer is cached by user id and kept up to date when keys are saved
+    or deleted, so it usually costs no queries.
+    """
+    if not user.is_authenticated():
+        return False
+    key = CONNECTED_CACHE_KEY % user.pk
+    connected = cache.get(key)
+    if connected is None:
+        connected = StripeAccessKey.objects.filter(user=user).exists()
+        cache.set(key, connected, CONNECTED_CACHE_TIMEOUT)
+    return connected
+
+
+@receiver(post_save, sender=StripeAccessKey)
+def cache_stripe_connected(sender, instance, **kwargs):
+    cache.set(CONNECTED_CACHE_KEY % instance.user_id, True,
+              CONNECTED_CACHE_TIMEOUT)
+
+
+@receiver(post_delete, sender=StripeAccessKey)
+def cache_stripe_disconnected(sender, instance, **kwargs):
+    cache.set(CONNECTED_CACHE_KEY % instance.user_id, False,
+              CONNECTED_CACHE_TIMEOUT)
+
+
 class StripeTransaction(models.Model):
     """Record of payments made by students.
     
@@ -0,0 +1,20 @@
+from django import template
+
+from users.models import get_user_role
+
+from ..models import is_stripe_connected
+
+
+register = template.Library()
+
+
+@register.filter
+def needs_stripe_connect(user):
+    """Returns True for tutors who haven't connected a Stripe account."""
+    return get_user_role(user) == 'Tutor' and not is_stripe_connected(user)
+
+
+@register.filter
+def stripe_connected(user):
+    """Returns whether a user has connected a Stripe account."""
+    return is_stripe_connected(user)
@@ -5,8 +5,18 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.auth.models import Group
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.template import Context
+from django.template import Template
 from django.test import TestCase
 
+from .models import StripeAccessKey
+from .models import is_stripe_connected
+from .views import check_user_for_stripe
+
 
 class SimpleTest(TestCase):
     def test_basic_addition(self):
@@ -14,3 +24,45 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class StripeConnectedTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('tutor', 'tutor@example.com',
+                                             'password')
+        self.user.groups.add(Group.objects.create(name='Tutors'))
+
+    def test_connected_status_is_cached(self):
+        self.assertNumQueries(1, is_stripe_connected, self.user)
+        self.assertNumQueries(0, is_stripe_connected, self.user)
+        self.assertFalse(is_stripe_connected(self.user))
+
+    def test_key_changes(self):
+        is_stripe_connected(self.user)
+        key = StripeAccessKey.objects.create(user=self.user, access_key='sk')
+        self.assertNumQueries(0, is_stripe_connected, self.user)
+        self.assertTrue(is_stripe_connected(self.user))
+        self.assertEqual(check_user_for_stripe(self.user), key)
+        key.delete()
+        self.assertFalse(is_stripe_connected(self.user))
+        self.assertNumQueries(0, check_user_for_stripe, self.user)
+
+    def test_template_filter(self):
+        template = Template('{% load stripe_connect_tags %}'
+                            '{% if user|needs_stripe_connect %}prompt{% endif %}')
+        self.assertEqual(template.render(Context({'user': self.user})),
+                         'prompt')
+        StripeAccessKey.objects.create(user=self.user, access_key='sk')
+        self.assertEqual(template.render(Context({'user': self.user})), '')
+        self.assertEqual(template.render(Context({'user': AnonymousUser()})),
+                         '')
+
+    def test_connected_filter(self):
+        template = Template('{% load stripe_connect_tags %}'
+                            '{% if user|stripe_connected %}pay{% endif %}')
+        self.assertEqual(template.render(Context({'user': self.user})), '')
+        StripeAccessKey.objects.create(user=self.user, access_key='sk')
+        self.assertEqual(template.render(Context({'user': self.user})),
+                         'pay')
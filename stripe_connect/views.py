@@ -17,6 +17,7 @@ from projects.models import Project
 from .forms import StripeTransactionForm
 from .models import StripeAccessKey
 from .models import StripeTransaction
+from .models import is_stripe_connected
 
 
 def check_user_for_stripe(user):
@@ -24,6 +25,9 @@ def check_user_for_stripe(user):
     
     Returns the key object if found, or False.
     """
+    # Users without a key are the common case, and that's cached
+    if not is_stripe_connected(user):
+        return False
     try:
         key = StripeAccessKey.objects.get(user=user)
         return key
@@ -162,7 +166,10 @@ class TransactionCreateView(CreateView):
 
     def get_context_data(self, *args, **kwargs):
         context = super(TransactionCreateView, self).get_context_data(*args, **kwargs)
-        project = get_object_or_404(Project, pk=self.kwargs['project_id'])
+        project = get_object_or_404(
+            Project.objects.select_related('student__user',
+                                           'awarded_tutor__user'),
+            pk=self.kwargs['project_id'])
         context['project'] = project
         context['stripe_published_key'] = settings.STRIPE_PUBLISHABLE
         return context 
@@ -174,7 +181,8 @@ class TransactionCreateView(CreateView):
 
 class TransactionDetailView(DetailView):
     context_object_name = 'transaction'
-    queryset = StripeTransaction.objects.all()
+    queryset = StripeTransaction.objects.select_related(
+        'project__student__user', 'project__awarded_tutor__user')
 
     @method_decorator(login_required)
     def dispatch(self, *args, **kwargs):
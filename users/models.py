@@ -1,6 +1,8 @@
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
+from django.db.models.signals import m2m_changed
 from django.dispatch import receiver
 
 from registration.signals import user_activated
@@ -24,6 +26,55 @@ class Timezone(models.Model):
         return self.name
 
 
+# Groups users are registered into and the role each one gives them
+ROLE_GROUPS = (('Students', 'Student'), ('Tutors', 'Tutor'))
+ROLE_CACHE_KEY = 'users:role:%s'
+ROLE_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def get_user_role(user):
+    """Returns 'Student', 'Tutor' or None for a user.
+
+    The role is kept on the user object for the rest of the request and
+    cached across requests until the user's groups change, so it costs at
+    most one query.
+    """
+    if not user.is_authenticated():
+        return None
+    if not hasattr(user, '_role_cache'):
+        key = ROLE_CACHE_KEY % user.pk
+        role = cache.get(key)
+        if role is None:
+            group_names = set(user.groups.filter(
+                name__in=[group for group, role in ROLE_GROUPS]
+            ).values_list('name', flat=True))
+            # Users without a role are cached as ''
+            role = ''
+            for group_name, group_role in ROLE_GROUPS:
+                if group_name in group_names:
+                    role = group_role
+                    break
+            cache.set(key, role, ROLE_CACHE_TIMEOUT)
+        user._role_cache = role or None
+    return user._role_cache
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def clear_user_role_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    """Forgets the cached roles of users whose groups change."""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        user_ids = [instance.pk]
+        instance.__dict__.pop('_role_cache', None)
+    elif action == 'pre_clear':
+        # Group.user_set.clear() doesn't say which users it removes
+        user_ids = instance.user_set.values_list('pk', flat=True)
+    else:
+        user_ids = pk_set
+    cache.delete_many([ROLE_CACHE_KEY % user_id for user_id in user_ids])
+
+
 class UserProfile(models.Model):
     """Fields common to tutors and students."""
     user = models.ForeignKey(User, unique=True)
@@ -50,10 +101,7 @@ class UserProfile(models.Model):
 
     def get_user_type(self):
         """Returns 'Tutor' or 'Student'."""
-        if self.user.groups.filter(name='Students').exists():
-            return 'Student'
-        elif self.user.groups.filter(name='Tutors').exists():
-            return 'Tutor'
+        return get_user_role(self.user)
 
     def get_location(self):
         """Returns 'city, state, country', or a subset if some are blank."""
@@ -82,9 +130,10 @@ def create_blank_user_profile(sender, user, **kwargs):
     try:
         user.get_profile()
     except ObjectDoesNotExist:
-        if user.groups.filter(name='Students').exists():
+        role = get_user_role(user)
+        if role == 'Student':
             new_profile = Student(user=user)
             new_profile.save()
-        elif user.groups.filter(name='Tutors').exists():
+        elif role == 'Tutor':
             new_profile = Tutor(user=user)
             new_profile.save()
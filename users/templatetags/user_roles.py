@@ -0,0 +1,12 @@
+from django import template
+
+from ..models import get_user_role
+
+
+register = template.Library()
+
+
+@register.filter
+def user_role(user):
+    """Returns 'Student', 'Tutor' or None for a user."""
+    return get_user_role(user)
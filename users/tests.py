@@ -5,8 +5,15 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.auth.models import Group
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
 
+from .models import UserProfile
+from .models import get_user_role
+
 
 class SimpleTest(TestCase):
     def test_basic_addition(self):
@@ -14,3 +21,43 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class UserRoleTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.students = Group.objects.create(name='Students')
+        self.tutors = Group.objects.create(name='Tutors')
+        self.user = User.objects.create_user('student', 'student@example.com',
+                                             'password')
+        self.user.groups.add(self.students)
+
+    def get_user(self):
+        return User.objects.get(pk=self.user.pk)
+
+    def test_role(self):
+        user = self.get_user()
+        self.assertNumQueries(1, get_user_role, user)
+        self.assertEqual(get_user_role(user), 'Student')
+        # Later requests use the cache
+        self.assertNumQueries(0, get_user_role, self.get_user())
+
+    def test_no_role(self):
+        self.user.groups.clear()
+        user = self.get_user()
+        self.assertEqual(get_user_role(user), None)
+        self.assertNumQueries(0, get_user_role, self.get_user())
+        self.assertEqual(get_user_role(AnonymousUser()), None)
+
+    def test_group_changes(self):
+        get_user_role(self.get_user())
+        self.user.groups.remove(self.students)
+        self.tutors.user_set.add(self.user)
+        self.assertEqual(get_user_role(self.get_user()), 'Tutor')
+        self.tutors.user_set.clear()
+        self.assertEqual(get_user_role(self.get_user()), None)
+
+    def test_get_user_type(self):
+        profile = UserProfile.objects.create(user=self.user)
+        self.assertEqual(profile.get_user_type(), 'Student')
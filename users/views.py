@@ -7,12 +7,14 @@ from django.template import RequestContext
 from django.views.generic import DetailView
 from django.utils.decorators import method_decorator
 
+from projects.models import Bid
 from projects.views import ProjectListView
 
 from .forms import UserForm
 from .forms import UserProfileForm
 from .forms import TutorProfileForm
 from .models import UserProfile
+from .models import get_user_role
 
 
 class DashboardView(ProjectListView):
@@ -22,23 +24,25 @@ class DashboardView(ProjectListView):
     A tutor's dashboard shows all projects the tutor has bid on.
     """
     def get_template_names(self):
-        user = self.request.user
-        if user.groups.filter(name='Students').exists():
+        role = get_user_role(self.request.user)
+        if role == 'Student':
             template = 'users/student-dashboard.html'
-        elif user.groups.filter(name='Tutors').exists():
+        elif role == 'Tutor':
             template = 'users/tutor-dashboard.html'
         else:
             return HttpResponseRedirect('/')
         return template
 
-    def get_queryset(self):
-        queryset = super(DashboardView, self).get_queryset()
+    def get_base_queryset(self):
+        queryset = super(DashboardView, self).get_base_queryset()
         user = self.request.user
         profile = user.get_profile()
-        if user.groups.filter(name='Students').exists():
+        role = get_user_role(user)
+        if role == 'Student':
             queryset = queryset.filter(student=profile)
-        elif user.groups.filter(name='Tutors').exists():
-            queryset = queryset.filter(project_bids__tutor=profile).distinct()
+        elif role == 'Tutor':
+            bids = Bid.objects.filter(tutor=profile)
+            queryset = queryset.filter(pk__in=bids.values('project'))
         return queryset
 
 
@@ -88,10 +92,11 @@ def edit_profile(request):
         profile = None
 
     # Fetch user type and appropriate form
-    if user.groups.filter(name='Students').exists():
+    role = get_user_role(user)
+    if role == 'Student':
         user_type = 'student'
         extra_form = UserProfileForm
-    elif user.groups.filter(name='Tutors').exists():
+    elif role == 'Tutor':
         user_type = 'tutor'
         if profile:
             profile = profile.tutor